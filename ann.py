@@ -0,0 +1,177 @@
+"""Approximate nearest-neighbour search over the normalized embedding matrix.
+
+An IVF (inverted file) index: spherical k-means partitions the rows into lists,
+and a query only scores the rows of the ``n_probe`` lists whose centroids are
+closest to it. Build it offline next to the vector index and benchmark its
+recall against the exact scan with::
+
+    python ann.py build --lists 1024
+    python ann.py bench --k 50 --nprobe 1 4 8 16 32
+"""
+import argparse
+import hashlib
+import logging
+import pickle
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from scoring import ScoringEngine, select_top_k
+
+DEFAULT_INDEX_FILE = "vector_index.pkl"
+DEFAULT_ANN_FILE = "vector_index.ivf.npz"
+
+
+def matrix_fingerprint(matrix: np.ndarray) -> str:
+    """Cheap fingerprint of a matrix (shape plus a strided row sample) to detect a stale ANN file."""
+    stride = max(1, matrix.shape[0] // 1024)
+    digest = hashlib.sha1(repr(matrix.shape).encode())
+    digest.update(np.ascontiguousarray(matrix[::stride]).tobytes())
+    return digest.hexdigest()
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """Index of the closest centroid (by cosine) for every row, computed in chunks."""
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], chunk_size):
+        block = matrix[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(matrix: np.ndarray, n_clusters: int, iterations: int = 10,
+                     sample_size: int = 131072, seed: int = 0) -> np.ndarray:
+    """Train unit-norm centroids on a sample of the (already normalized) rows."""
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    sample = matrix if n <= sample_size else matrix[np.sort(rng.choice(n, sample_size, replace=False))]
+    centroids = sample[rng.choice(sample.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists with random rows so every list stays useful.
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """Rows bucketed by nearest centroid; ``list_rows[list_offsets[i]:list_offsets[i + 1]]`` is list ``i``."""
+
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_rows: np.ndarray, fingerprint: str = ''):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.list_rows = np.asarray(list_rows, dtype=np.int32)
+        self.fingerprint = fingerprint
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    def __len__(self) -> int:
+        return self.list_rows.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_lists: Optional[int] = None, iterations: int = 10, seed: int = 0) -> "IVFIndex":
+        n = matrix.shape[0]
+        if n_lists is None:
+            n_lists = int(round(4 * np.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+        centroids = spherical_kmeans(matrix, n_lists, iterations=iterations, seed=seed)
+        assignments = _assign(matrix, centroids)
+        list_rows = np.argsort(assignments, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_rows, matrix_fingerprint(matrix))
+
+    def candidates(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        """Row ids in the ``n_probe`` lists closest to a normalized query."""
+        probes = select_top_k(self.centroids @ query, max(1, n_probe))
+        return np.concatenate([self.list_rows[self.list_offsets[p]:self.list_offsets[p + 1]] for p in probes])
+
+    def search(self, matrix: np.ndarray, query_vector, k: int, n_probe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate ``ScoringEngine.top_k``: exact scores, but only over the probed lists.
+
+        More lists are probed while they hold fewer than ``k`` rows, so fewer than ``k``
+        results means the whole index was scanned, as with the exact scan.
+        """
+        query = ScoringEngine.normalize(query_vector)
+        rows = self.candidates(query, n_probe)
+        while len(rows) < k and n_probe < self.n_lists:
+            n_probe = min(self.n_lists, max(1, n_probe) * 2)
+            rows = self.candidates(query, n_probe)
+        scores = matrix[rows] @ query
+        best = select_top_k(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, path: str) -> None:
+        np.savez(path, centroids=self.centroids, list_offsets=self.list_offsets,
+                 list_rows=self.list_rows, fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data['centroids'], data['list_offsets'], data['list_rows'], str(data['fingerprint']))
+
+
+def load_matrix(index_file: str = DEFAULT_INDEX_FILE) -> np.ndarray:
+    with open(index_file, "rb") as f:
+        vector_index = pickle.load(f)
+    return ScoringEngine(vector_index['embeddings']).matrix
+
+
+def benchmark(matrix: np.ndarray, ann: IVFIndex, k: int, n_probes, n_queries: int = 200,
+              noise: float = 0.05, seed: int = 0) -> None:
+    """Print recall@k and mean latency of each n_probe setting against the exact scan."""
+    rng = np.random.default_rng(seed)
+    engine = ScoringEngine.from_normalized(matrix)
+    # Perturbed catalog rows stand in for real queries so no model is needed.
+    picks = rng.choice(matrix.shape[0], min(n_queries, matrix.shape[0]), replace=False)
+    queries = matrix[picks] + rng.normal(scale=noise, size=(len(picks), matrix.shape[1])).astype(np.float32)
+
+    started = time.perf_counter()
+    exact = [set(engine.top_k(q, k)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    print(f"exact      recall@{k}=1.000  {exact_ms:8.3f} ms/query")
+    for n_probe in n_probes:
+        started = time.perf_counter()
+        found = [ann.search(matrix, q, k, n_probe)[0] for q in queries]
+        ann_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        recall = np.mean([len(truth.intersection(ids.tolist())) / max(1, len(truth)) for truth, ids in zip(exact, found)])
+        print(f"nprobe={n_probe:<4d} recall@{k}={recall:.3f}  {ann_ms:8.3f} ms/query")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or benchmark the IVF approximate index.")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="vector index pickle to read")
+    parser.add_argument("--output", default=DEFAULT_ANN_FILE, help="ANN index file to write or read")
+    parser.add_argument("--lists", type=int, default=None, help="number of IVF lists (default 4*sqrt(rows))")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    matrix = load_matrix(args.index)
+    if args.command == "build":
+        started = time.perf_counter()
+        ann = IVFIndex.build(matrix, n_lists=args.lists, iterations=args.iterations)
+        ann.save(args.output)
+        logging.info(f"Built IVF index with {ann.n_lists} lists over {len(ann)} rows in "
+                     f"{time.perf_counter() - started:.1f}s -> {args.output}")
+    else:
+        ann = IVFIndex.load(args.output)
+        benchmark(matrix, ann, args.k, args.nprobe, n_queries=args.queries)
+
+
+if __name__ == "__main__":
+    main()
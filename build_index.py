@@ -0,0 +1,156 @@
+"""Build ``vector_index.pkl`` from ``data.json``.
+
+Every ``Key::version`` entry is embedded from its title, summary and tags. The
+index keeps a content hash per entry, so a rebuild only re-embeds entries that
+are new or whose text changed and copies every other row from the previous
+index::
+
+    python build_index.py --processes 4
+    python build_index.py --store        # also write the memory-mapped vector_index/
+
+An existing ``vector_index/`` is refreshed as well, since the app prefers it over the pickle.
+"""
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from data_loader import MODEL_NAME
+from index_store import DEFAULT_STORE_DIR, IndexStore, write_store
+from tags import normalize_tags
+
+DEFAULT_DATA_FILE = "data.json"
+DEFAULT_INDEX_FILE = "vector_index.pkl"
+
+
+def version_text(title: str, version_data: Dict[str, Any]) -> str:
+    """The text embedded for one version of a package."""
+    parts = [title, version_data.get("Summary") or "", version_data.get("Tags") or ""]
+    return " ".join(part.strip() for part in parts if part and part.strip())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def collect_entries(software_data: Dict[str, Any]) -> Tuple[List[str], List[str], Dict[str, Any]]:
+    """Return (metadata ids, texts, tag_map) for every version in ``data.json`` order."""
+    metadata, texts, tag_map = [], [], {}
+    for key, software_info in software_data.items():
+        title = software_info.get("Title", key)
+        for version_idx, version_data in enumerate(software_info.get("Versions") or []):
+            metadata_id = f"{key}::{version_idx}"
+            metadata.append(metadata_id)
+            texts.append(version_text(title, version_data))
+            tag_map[metadata_id] = version_data.get("Tags") or ""
+    return metadata, texts, tag_map
+
+
+def top_tags(tag_map: Dict[str, Any], count: int) -> List[str]:
+    counts = collections.Counter(tag for tags in tag_map.values() for tag in normalize_tags(tags))
+    return [tag for tag, _ in counts.most_common(count)]
+
+
+def encode(texts: List[str], processes: int = 1, batch_size: int = 64) -> np.ndarray:
+    """Embed ``texts`` with the search model, spread over ``processes`` encoder processes."""
+    model = SentenceTransformer(MODEL_NAME)
+    if processes > 1 and len(texts) > batch_size:
+        pool = model.start_multi_process_pool(target_devices=["cpu"] * processes)
+        try:
+            embeddings = model.encode_multi_process(texts, pool, batch_size=batch_size)
+        finally:
+            model.stop_multi_process_pool(pool)
+    else:
+        embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def build(software_data: Dict[str, Any], previous: Optional[Dict[str, Any]] = None,
+          processes: int = 1, batch_size: int = 64, tag_count: int = 10) -> Dict[str, Any]:
+    """Build the ``vector_index`` dict, reusing rows of ``previous`` whose content hash is unchanged."""
+    metadata, texts, tag_map = collect_entries(software_data)
+    hashes = [content_hash(text) for text in texts]
+
+    reuse: Dict[str, int] = {}
+    if previous is not None and previous.get("content_hashes"):
+        previous_row = {(metadata_id, digest): row for row, (metadata_id, digest)
+                        in enumerate(zip(previous["metadata"], previous["content_hashes"]))}
+        for metadata_id, digest in zip(metadata, hashes):
+            row = previous_row.get((metadata_id, digest))
+            if row is not None:
+                reuse[metadata_id] = row
+
+    missing = [row for row, metadata_id in enumerate(metadata) if metadata_id not in reuse]
+    logging.info(f"{len(metadata)} entries: reusing {len(reuse)}, embedding {len(missing)}.")
+    dim = None
+    encoded = None
+    if missing:
+        encoded = encode([texts[row] for row in missing], processes=processes, batch_size=batch_size)
+        dim = encoded.shape[1]
+    elif previous is not None:
+        dim = np.asarray(previous["embeddings"]).shape[1]
+
+    embeddings = np.zeros((len(metadata), dim or 0), dtype=np.float32)
+    if reuse:
+        old = np.asarray(previous["embeddings"], dtype=np.float32)
+        new_rows = np.fromiter((row for row, metadata_id in enumerate(metadata) if metadata_id in reuse), dtype=np.int64)
+        embeddings[new_rows] = old[[reuse[metadata[row]] for row in new_rows]]
+    if encoded is not None:
+        embeddings[missing] = encoded
+
+    return {
+        "metadata": metadata,
+        "embeddings": embeddings,
+        "tag_map": tag_map,
+        "top_tags": top_tags(tag_map, tag_count),
+        "content_hashes": hashes,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or refresh the vector index from data.json.")
+    parser.add_argument("--data", default=DEFAULT_DATA_FILE, help="catalog to index")
+    parser.add_argument("--output", default=DEFAULT_INDEX_FILE, help="vector index pickle to update or write")
+    parser.add_argument("--processes", type=int, default=1, help="encoder processes")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--top-tags", type=int, default=10, help="tags listed as categories on the start screen")
+    parser.add_argument("--full", action="store_true", help="ignore the existing index and re-embed everything")
+    parser.add_argument("--store", nargs="?", const=DEFAULT_STORE_DIR, default=None,
+                        help="also write the memory-mapped index directory (default vector_index; "
+                             "an existing one is always refreshed)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.store is None and IndexStore.exists(DEFAULT_STORE_DIR):
+        # data_loader serves the directory whenever it exists, so leaving it behind would serve the old index.
+        args.store = DEFAULT_STORE_DIR
+
+    started = time.perf_counter()
+    with open(args.data, "r", encoding="utf-8") as f:
+        software_data = json.load(f)
+    previous = None
+    if not args.full and os.path.exists(args.output):
+        with open(args.output, "rb") as f:
+            previous = pickle.load(f)
+    vector_index = build(software_data, previous, processes=args.processes,
+                         batch_size=args.batch_size, tag_count=args.top_tags)
+
+    tmp = args.output + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(vector_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, args.output)
+    logging.info(f"Wrote {len(vector_index['metadata'])} entries to {args.output} in {time.perf_counter() - started:.1f}s")
+    if args.store:
+        write_store(args.store, vector_index, software_data, args.data)
+        logging.info(f"Wrote memory-mapped index to {args.store}")
+
+
+if __name__ == "__main__":
+    main()
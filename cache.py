@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Bounded least-recently-used mapping with hit, miss and eviction counters.
+
+    A ``maxsize`` of 0 disables caching: every lookup is a miss and nothing is stored.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        if maxsize < 0:
+            raise ValueError("maxsize must be >= 0")
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize == 0:
+            return
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class GenerationCache(LRUCache):
+    """LRU cache whose entries are only valid for one index generation.
+
+    Call ``sync`` with the current generation before each lookup; a different
+    generation drops every entry, so a data reload can never serve stale results.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        super().__init__(maxsize)
+        self.generation: Optional[int] = None
+        self.invalidations = 0
+
+    def sync(self, generation: int) -> None:
+        if generation != self.generation:
+            if self._data:
+                self.invalidations += 1
+            self.clear()
+            self.generation = generation
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        stats['generation'] = self.generation
+        stats['invalidations'] = self.invalidations
+        return stats
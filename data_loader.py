@@ -1,36 +1,291 @@
+import gc
 import json
+import os
 import pickle
 import logging
-from sentence_transformers import SentenceTransformer
+import time
 
+from ann import DEFAULT_ANN_FILE, IVFIndex, matrix_fingerprint
+from index_store import DEFAULT_STORE_DIR, MANIFEST, IndexStore, file_stamp
+from knn import DEFAULT_KNN_FILE, KNNGraph
+from rows import RowTable
+from scoring import ScoringEngine
+from shared import attach_arrays, publish_arrays
+from tags import TagIndex
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
 MODEL = None
+# 'pending', 'loading', 'ready' or 'failed'; the index can be served before the model is ready.
+MODEL_STATE = 'pending'
 SOFTWARE_DATA = {}
 VECTOR_INDEX = {}
+ENGINE = None
+ROWS = None
+TAGS = None
+ANN = None
+ANN_INDEX_FILE = DEFAULT_ANN_FILE
+KNN = None
+KNN_GRAPH_FILE = DEFAULT_KNN_FILE
+# Memory-mapped index directory (see index_store.py); vector_index.pkl is used when it is absent.
+INDEX_DIR = DEFAULT_STORE_DIR
+STORE = None
+# None (float32 scan), 'float16' or 'int8'; see scoring.QuantizedScan.
+QUANTIZATION = None
+RERANK_FACTOR = 4
+# Bumped after every successful load or reload so caches keyed on the index can tell data apart.
+GENERATION = 0
+# Seconds spent in each phase of the last load_data_and_model call, reported to the client.
+LOAD_TIMINGS = {}
 _top_tags = []
+# File stamps (see source_stamps) of the files the live generation was built from.
+SOURCE_STAMPS = None
+# Shared-memory blocks backing ENGINE.matrix when it is shared between worker processes,
+# and whether this process published (and so must unlink) them.
+_SHARED_BLOCKS = []
+_SHARED_OWNER = False
+
+
+def _load_ann(matrix):
+    """Load the optional IVF index built by ``ann.py``, ignoring it if it was built for other data."""
+    if not os.path.exists(ANN_INDEX_FILE):
+        return None
+    try:
+        ann = IVFIndex.load(ANN_INDEX_FILE)
+    except Exception as e:
+        logging.warning(f"Could not load ANN index {ANN_INDEX_FILE}: {e}")
+        return None
+    if len(ann) != matrix.shape[0] or ann.fingerprint != matrix_fingerprint(matrix):
+        logging.warning(f"ANN index {ANN_INDEX_FILE} does not match vector_index.pkl; rebuild it with 'python ann.py build'.")
+        return None
+    logging.info(f"Loaded ANN index with {ann.n_lists} lists.")
+    return ann
+
+
+def _load_knn(metadata, matrix):
+    """Load the optional related-packages graph built by ``knn.py`` and bind it to the live rows."""
+    if not os.path.exists(KNN_GRAPH_FILE):
+        return None
+    try:
+        graph = KNNGraph.load(KNN_GRAPH_FILE)
+    except Exception as e:
+        logging.warning(f"Could not load neighbour graph {KNN_GRAPH_FILE}: {e}")
+        return None
+    covered = graph.bind(metadata, matrix)
+    if graph.stale_rows:
+        logging.warning(f"Neighbour graph {KNN_GRAPH_FILE} has {graph.stale_rows} rows built from older embeddings; "
+                        f"they use an exact scan until it is refreshed with 'python knn.py build'.")
+    logging.info(f"Loaded neighbour graph (k={graph.k}) covering {covered} of {len(metadata)} rows.")
+    return graph
+
+
+def unlink_shared_index():
+    """Remove the blocks this process published; workers attached to them keep their mappings."""
+    global _SHARED_OWNER
+    if not _SHARED_OWNER:
+        return
+    for block in _SHARED_BLOCKS:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+    _SHARED_OWNER = False
+
+
+class _DroppedArray:
+    """Stands in for a pickled NumPy array whose data is not needed."""
+
+    def __init__(self, *args):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+
+class _MetadataUnpickler(pickle.Unpickler):
+    """Unpickles vector_index.pkl without materializing its arrays, for workers attaching the matrix."""
+
+    def find_class(self, module, name):
+        if module.startswith('numpy') and name in ('_reconstruct', '_frombuffer'):
+            return _DroppedArray
+        return super().find_class(module, name)
 
 
-def load_data_and_model():
-    """Load semantic model and data files."""
-    global MODEL, SOFTWARE_DATA, VECTOR_INDEX, _top_tags
+def publish_shared_index():
+    """Move the normalized embedding matrix into shared memory and return its handle.
+
+    This process switches to the shared view, so the matrix is held once no matter
+    how many workers attach to it through ``load_data_and_model(shared_index=...)``.
+    """
+    global _SHARED_BLOCKS, _SHARED_OWNER
+    if STORE is not None:
+        logging.info("Embedding matrix is memory-mapped; workers share it through the page cache.")
+        return None
+    blocks, handle, views = publish_arrays({'embeddings': ENGINE.matrix})
+    ENGINE.matrix = views['embeddings']
+    VECTOR_INDEX['embeddings'] = ENGINE.matrix
+    _SHARED_BLOCKS = blocks
+    _SHARED_OWNER = True
+    logging.info(f"Published {ENGINE.matrix.nbytes} byte embedding matrix to shared memory.")
+    return handle
+
+
+def load_model():
+    """Load the sentence-transformer; safe to run in a background thread after ``load_index``."""
+    global MODEL, MODEL_STATE
+    MODEL_STATE = 'loading'
     logging.info("Loading semantic search model (SentenceTransformer)...")
+    started = time.perf_counter()
     try:
-        MODEL = SentenceTransformer('all-MiniLM-L6-v2')
-        logging.info("SentenceTransformer model loaded successfully.")
+        # Imported here: torch and sentence-transformers take seconds to import, and the
+        # index can be served before they are needed.
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(MODEL_NAME)
     except Exception as e:
         logging.error(f"Failed to load SentenceTransformer model: {e}")
+        MODEL_STATE = 'failed'
         return False
+    LOAD_TIMINGS['model_load'] = time.perf_counter() - started
+    MODEL = model
+    MODEL_STATE = 'ready'
+    logging.info("SentenceTransformer model loaded successfully.")
+    return True
+
 
+def build_generation(shared_index=None, timings=None):
+    """Load data.json and the vector index and build everything derived from them.
+
+    Returns a dict of the module globals that make up one generation (see
+    ``activate``) without touching the live ones, so it can run in a background
+    thread while requests are served, or None if loading failed. The index comes
+    from the memory-mapped ``INDEX_DIR`` when it exists, otherwise from
+    vector_index.pkl. With ``shared_index`` (from ``publish_shared_index`` in
+    another process) a pickled index's matrix is attached from shared memory
+    instead of normalized locally.
+    """
+    timings = {} if timings is None else timings
+    stamps = source_stamps()
+    shared_blocks = []
     logging.info("Attempting to load data.json and vector_index.pkl...")
     try:
+        started = time.perf_counter()
         with open("data.json", 'r', encoding='utf-8') as f:
-            SOFTWARE_DATA = json.load(f)
-            logging.info(f"Loaded data.json with {len(SOFTWARE_DATA)} entries.")
-        with open("vector_index.pkl", "rb") as f:
-            VECTOR_INDEX = pickle.load(f)
-            logging.info(f"Loaded vector_index.pkl with {len(VECTOR_INDEX.get('metadata',[]))} metadata entries.")
-        _top_tags[:] = VECTOR_INDEX.get('top_tags', [])
-        logging.info(f"Top tags: {_top_tags}")
+            software_data = json.load(f)
+            logging.info(f"Loaded data.json with {len(software_data)} entries.")
+        timings['data_json_parse'] = time.perf_counter() - started
+        started = time.perf_counter()
+        if IndexStore.exists(INDEX_DIR):
+            store = IndexStore.open(INDEX_DIR)
+            vector_index = store.vector_index()
+            logging.info(f"Opened memory-mapped index {INDEX_DIR} with {len(store)} rows.")
+            timings['index_open'] = time.perf_counter() - started
+        else:
+            store = None
+            with open("vector_index.pkl", "rb") as f:
+                # Attaching workers take the matrix from shared memory, so don't build N private copies of it.
+                vector_index = _MetadataUnpickler(f).load() if shared_index else pickle.load(f)
+                logging.info(f"Loaded vector_index.pkl with {len(vector_index.get('metadata',[]))} metadata entries.")
+            timings['index_unpickle'] = time.perf_counter() - started
+        started = time.perf_counter()
+        if store is not None:
+            # Already normalized on disk: score straight off the memory map, no copy.
+            engine = ScoringEngine.from_normalized(vector_index['embeddings'])
+            if QUANTIZATION:
+                engine.quantize(QUANTIZATION, RERANK_FACTOR)
+        elif shared_index:
+            shared_blocks, arrays = attach_arrays(shared_index)
+            if arrays['embeddings'].shape[0] != len(vector_index.get('metadata', [])):
+                raise ValueError("Shared embedding matrix does not match vector_index.pkl")
+            engine = ScoringEngine.from_normalized(arrays['embeddings'])
+            if QUANTIZATION:
+                engine.quantize(QUANTIZATION, RERANK_FACTOR)
+            logging.info("Attached embedding matrix from shared memory.")
+        else:
+            # Normalize once here so queries only need a dot product; keep just the float32 copy.
+            engine = ScoringEngine(vector_index['embeddings'], quantization=QUANTIZATION, rerank_factor=RERANK_FACTOR)
+            if QUANTIZATION:
+                logging.warning(f"{QUANTIZATION} quantization keeps the float32 matrix in memory for re-ranking, "
+                                f"so it adds memory rather than saving it; convert the index with "
+                                f"'python index_store.py convert' to re-rank from the memory-mapped {INDEX_DIR}/.")
+        vector_index['embeddings'] = engine.matrix
+        logging.info(f"Scoring engine ready: {len(engine)} x {engine.dim} float32 matrix.")
+        if engine.scan is not None:
+            logging.info(f"Scanning a {engine.scan.mode} copy ({engine.scan.nbytes} bytes), "
+                         f"re-ranking {engine.rerank_factor}x the requested rows at full precision.")
+        metadata = vector_index.get('metadata', [])
+        ann = _load_ann(engine.matrix)
+        knn = _load_knn(metadata, engine.matrix)
+        updated_ms = store.updated_ms_for("data.json") if store is not None else None
+        rows = RowTable(metadata, software_data, updated_ms=updated_ms)
+        logging.info(f"Row table built with {int(rows.valid.sum())} of {len(rows)} rows resolved "
+                     f"and {len(rows.row_by_id)} metadata ids indexed.")
+        if store is not None:
+            tags = store.tag_index(len(rows))
+        else:
+            tags = TagIndex.from_tag_map(vector_index.get('tag_map', {}), rows.row_by_id, len(rows))
+        logging.info(f"Tag index built with {len(tags)} distinct tags.")
+        top_tags = list(vector_index.get('top_tags', []))
+        logging.info(f"Top tags: {top_tags}")
+        timings['index_build'] = time.perf_counter() - started
     except (FileNotFoundError, Exception) as e:
         logging.error(f"Data file loading error: {e}")
+        return None
+    return {
+        'SOFTWARE_DATA': software_data, 'VECTOR_INDEX': vector_index, 'ENGINE': engine, 'ROWS': rows,
+        'TAGS': tags, 'ANN': ann, 'KNN': knn, 'STORE': store, 'SOURCE_STAMPS': stamps,
+        '_top_tags': top_tags, '_SHARED_BLOCKS': shared_blocks, '_SHARED_OWNER': False,
+    }
+
+
+def activate(generation):
+    """Make a ``build_generation`` result the live index and return the one it replaced.
+
+    Call it between requests: every reader looks the globals up per request, so a
+    request sees either the old generation or the new one, never a mix.
+    """
+    global GENERATION
+    module = globals()
+    previous = {name: module[name] for name in generation}
+    module.update(generation)
+    GENERATION += 1
+    return previous
+
+
+def release_generation(previous):
+    """Drop a replaced generation and close (and, if this process published it, unlink) its shared memory."""
+    blocks = previous.get('_SHARED_BLOCKS') or []
+    owner = previous.get('_SHARED_OWNER', False)
+    previous.clear()
+    gc.collect()
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            logging.warning(f"Shared block {block.name} is still referenced; leaving it mapped.")
+        if owner:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def source_stamps():
+    """Size and mtime of the files an index generation is built from, for change detection."""
+    return (file_stamp("data.json"), file_stamp("vector_index.pkl"), file_stamp(os.path.join(INDEX_DIR, MANIFEST)))
+
+
+def load_index(shared_index=None):
+    """Build the first generation (see ``build_generation``) and make it live.
+
+    Tag and default queries work once this returns; semantic queries also need ``load_model``.
+    """
+    LOAD_TIMINGS.clear()
+    generation = build_generation(shared_index=shared_index, timings=LOAD_TIMINGS)
+    if generation is None:
         return False
+    activate(generation)
     return True
+
+
+def load_data_and_model(shared_index=None):
+    """Load the data files and index, then the semantic model."""
+    return load_index(shared_index=shared_index) and load_model()
@@ -0,0 +1,19 @@
+"""Display helpers with no heavy dependencies, safe to import in the UI process."""
+import re
+from datetime import datetime
+from typing import Optional
+
+
+def format_timestamp(date_str: Optional[str]) -> str:
+    if not date_str:
+        return "N/A"
+    match = re.search(r'\((\d+)\)', date_str)
+    if match:
+        timestamp_ms = match.group(1)
+        if timestamp_ms:
+            timestamp = int(timestamp_ms) / 1000
+            try:
+                return datetime.fromtimestamp(timestamp).strftime('%d %B %Y')
+            except (ValueError, OSError):
+                return "Invalid Date"
+    return "Invalid Date"
@@ -0,0 +1,236 @@
+"""Memory-mapped on-disk vector index.
+
+An index directory holds the L2-normalized embedding matrix as ``embeddings.npy``,
+opened with ``mmap_mode='r'`` so pages are read on demand and shared by every
+process through the page cache. Next to it are compact columns for the metadata
+ids, the tag postings and the per-row update times, plus a ``manifest.json`` with
+the format version, the shape and a checksum for every file. Convert an existing
+pickle and check a directory with::
+
+    python index_store.py convert
+    python index_store.py verify
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from rows import parse_date_ms
+from scoring import ScoringEngine
+from tags import TagIndex
+
+FORMAT = "savvy-vector-index"
+VERSION = 1
+DEFAULT_INDEX_FILE = "vector_index.pkl"
+DEFAULT_STORE_DIR = "vector_index"
+DEFAULT_DATA_FILE = "data.json"
+MANIFEST = "manifest.json"
+
+
+def _sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _replace(path: str, write) -> None:
+    """Write through a temporary file and rename it over ``path``.
+
+    Processes that still map the old file keep reading the old inode, so a live
+    index is never truncated underneath them.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _save_array(path: str, array: np.ndarray) -> None:
+    _replace(path, lambda f: np.save(f, np.ascontiguousarray(array)))
+
+
+def _save_json(path: str, value: Any) -> None:
+    _replace(path, lambda f: f.write(json.dumps(value).encode("utf-8")))
+
+
+def file_stamp(path: str) -> Optional[Dict[str, int]]:
+    """Size and modification time of a file, used to tell whether a column still matches it."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _updated_ms(metadata: List[str], software_data: Dict[str, Any]) -> np.ndarray:
+    updated = np.zeros(len(metadata), dtype=np.int64)
+    for row, metadata_id in enumerate(metadata):
+        try:
+            key, version_idx = metadata_id.split("::")
+            updated[row] = parse_date_ms(software_data[key]["Versions"][int(version_idx)].get("LastUpdated"))
+        except (KeyError, IndexError, ValueError, TypeError, AttributeError):
+            continue
+    return updated
+
+
+def write_store(path: str, vector_index: Dict[str, Any], software_data: Optional[Dict[str, Any]] = None,
+                data_file: Optional[str] = None) -> Dict[str, Any]:
+    """Write ``vector_index`` (the pickle's dict) as an index directory and return its manifest.
+
+    The old manifest is removed first and the new one written last, so a reader
+    never pairs a half-written set of columns with a manifest.
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    metadata = list(vector_index.get("metadata", []))
+    matrix = ScoringEngine(vector_index["embeddings"]).matrix
+    if matrix.shape[0] != len(metadata):
+        raise ValueError(f"{matrix.shape[0]} embeddings for {len(metadata)} metadata entries")
+    row_by_id: Dict[str, int] = {}
+    for row, metadata_id in enumerate(metadata):
+        row_by_id.setdefault(metadata_id, row)
+    tags, tag_offsets, tag_rows = TagIndex.from_tag_map(vector_index.get("tag_map", {}), row_by_id, len(metadata)).packed()
+
+    _save_array(os.path.join(path, "embeddings.npy"), matrix)
+    _save_json(os.path.join(path, "metadata.json"), metadata)
+    _save_json(os.path.join(path, "tags.json"), tags)
+    _save_array(os.path.join(path, "tag_offsets.npy"), tag_offsets)
+    _save_array(os.path.join(path, "tag_rows.npy"), tag_rows)
+    files = ["embeddings.npy", "metadata.json", "tags.json", "tag_offsets.npy", "tag_rows.npy"]
+    data_stamp = None
+    if software_data is not None:
+        _save_array(os.path.join(path, "updated_ms.npy"), _updated_ms(metadata, software_data))
+        files.append("updated_ms.npy")
+        data_stamp = file_stamp(data_file) if data_file else None
+
+    manifest = {
+        "format": FORMAT,
+        "version": VERSION,
+        "rows": matrix.shape[0],
+        "dim": matrix.shape[1],
+        "normalized": True,
+        "top_tags": list(vector_index.get("top_tags", [])),
+        "data_stamp": data_stamp,
+        "files": {
+            name: {"bytes": os.path.getsize(os.path.join(path, name)), "sha256": _sha256(os.path.join(path, name))}
+            for name in files
+        },
+    }
+    _save_json(manifest_path, manifest)
+    return manifest
+
+
+class IndexStore:
+    """An opened index directory; ``embeddings`` is a read-only memory map."""
+
+    def __init__(self, path: str, manifest: Dict[str, Any], metadata: List[str], embeddings: np.ndarray,
+                 tags: List[str], tag_offsets: np.ndarray, tag_rows: np.ndarray, updated_ms: Optional[np.ndarray]):
+        self.path = path
+        self.manifest = manifest
+        self.metadata = metadata
+        self.embeddings = embeddings
+        self.tags = tags
+        self.tag_offsets = tag_offsets
+        self.tag_rows = tag_rows
+        self.updated_ms = updated_ms
+
+    @staticmethod
+    def exists(path: str = DEFAULT_STORE_DIR) -> bool:
+        return os.path.exists(os.path.join(path, MANIFEST))
+
+    @classmethod
+    def open(cls, path: str = DEFAULT_STORE_DIR, verify: bool = False) -> "IndexStore":
+        """Open an index directory. File sizes are always checked; ``verify`` also checks the
+        checksums, which reads every page and so gives up the on-demand loading."""
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a {FORMAT} directory")
+        if manifest.get("version", 0) > VERSION:
+            raise ValueError(f"{path} uses index format version {manifest.get('version')}; this build reads up to {VERSION}")
+        for name, info in manifest["files"].items():
+            file_path = os.path.join(path, name)
+            if os.path.getsize(file_path) != info["bytes"]:
+                raise ValueError(f"{file_path} has {os.path.getsize(file_path)} bytes, manifest says {info['bytes']}")
+            if verify and _sha256(file_path) != info["sha256"]:
+                raise ValueError(f"{file_path} does not match its manifest checksum")
+
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        if embeddings.shape != (manifest["rows"], manifest["dim"]) or embeddings.dtype != np.float32:
+            raise ValueError(f"{path}/embeddings.npy is {embeddings.dtype} {embeddings.shape}, "
+                             f"manifest says float32 {(manifest['rows'], manifest['dim'])}")
+        with open(os.path.join(path, "metadata.json"), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        with open(os.path.join(path, "tags.json"), "r", encoding="utf-8") as f:
+            tags = json.load(f)
+        updated_ms = None
+        if "updated_ms.npy" in manifest["files"]:
+            updated_ms = np.load(os.path.join(path, "updated_ms.npy"), mmap_mode="r")
+        return cls(path, manifest, metadata, embeddings, tags,
+                   np.load(os.path.join(path, "tag_offsets.npy")),
+                   np.load(os.path.join(path, "tag_rows.npy"), mmap_mode="r"),
+                   updated_ms)
+
+    def __len__(self) -> int:
+        return self.manifest["rows"]
+
+    def vector_index(self) -> Dict[str, Any]:
+        """The pickle-shaped dict ``data_loader`` works with (tags come from ``tag_index``)."""
+        return {"metadata": self.metadata, "embeddings": self.embeddings, "top_tags": list(self.manifest.get("top_tags", []))}
+
+    def tag_index(self, n_rows: int) -> TagIndex:
+        return TagIndex.from_postings(self.tags, self.tag_offsets, self.tag_rows, n_rows)
+
+    def updated_ms_for(self, data_file: str) -> Optional[np.ndarray]:
+        """The stored timestamp column, if it was computed from this very ``data_file``."""
+        stamp = self.manifest.get("data_stamp")
+        if self.updated_ms is None or not stamp or stamp != file_stamp(data_file):
+            return None
+        return self.updated_ms
+
+
+def convert(index_file: str = DEFAULT_INDEX_FILE, output: str = DEFAULT_STORE_DIR,
+            data_file: Optional[str] = DEFAULT_DATA_FILE) -> Dict[str, Any]:
+    """Convert a ``vector_index.pkl`` into an index directory."""
+    with open(index_file, "rb") as f:
+        vector_index = pickle.load(f)
+    software_data = None
+    if data_file and os.path.exists(data_file):
+        with open(data_file, "r", encoding="utf-8") as f:
+            software_data = json.load(f)
+    return write_store(output, vector_index, software_data, data_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert or verify the memory-mapped vector index.")
+    parser.add_argument("command", choices=["convert", "verify"])
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="vector index pickle to convert")
+    parser.add_argument("--data", default=DEFAULT_DATA_FILE, help="data.json used for the timestamp column")
+    parser.add_argument("--output", default=DEFAULT_STORE_DIR, help="index directory to write or verify")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    started = time.perf_counter()
+    if args.command == "convert":
+        manifest = convert(args.index, args.output, args.data)
+        logging.info(f"Wrote {manifest['rows']} x {manifest['dim']} index to {args.output} "
+                     f"in {time.perf_counter() - started:.1f}s")
+    else:
+        store = IndexStore.open(args.output, verify=True)
+        logging.info(f"{args.output}: {len(store)} rows, format version {store.manifest['version']}, "
+                     f"checksums OK ({time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,431 @@
+"""Client side of the search worker: starts the worker processes and multiplexes requests to them.
+
+The UI process imports only this module, so it deliberately imports nothing heavy;
+the worker loop itself lives in ``worker.py``.
+"""
+import asyncio
+import itertools
 import multiprocessing
-from typing import Any, Dict, List
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
 
-from data_loader import load_data_and_model
-import search
+# Seconds between checks that the worker processes are still alive.
+_HEALTH_CHECK_S = 0.5
 
+# Reply for a request that a newer query from the same session replaced before it ran.
+SUPERSEDED = {'superseded': True}
+
+
+def unpack_results(payload: Any) -> Any:
+    """Expand a compact reply into light result dicts; any other reply is returned unchanged.
+
+    The dicts carry the card fields only; fetch the full record with ``SearchWorker.details``.
+    """
+    if not isinstance(payload, dict) or 'rows' not in payload:
+        return payload
+    lexical = payload.get('lexical', False)
+    return [
+        {'SoftwareTitle': title, 'Version': version, 'Summary': summary, 'Tags': tags,
+         '__metadata_id': metadata_id, '__row': row, '__score': score, '__updated_ms': updated_ms,
+         '__compact': True, '__lexical': lexical}
+        for row, score, updated_ms, metadata_id, title, version, summary, tags in zip(
+            payload['rows'], payload['scores'], payload['updated_ms'], payload['metadata_id'],
+            payload['title'], payload['version'], payload['summary'], payload['tags'])
+    ]
+
+
+def _search_message(query: str, session: Optional[str], compact: bool, offset: int, limit: Optional[int]) -> Dict[str, Any]:
+    """A search request; without ``limit`` the worker returns one page of ``search.PAGE_SIZE`` rows."""
+    message = {'type': 'search', 'query': query, 'session': session, 'compact': compact, 'offset': max(0, offset)}
+    if limit is not None:
+        message['limit'] = max(0, limit)
+    return message
+
+
+class ResultStream:
+    """The chunks of one streamed reply, in arrival order; iterate with ``for`` or ``async for``.
+
+    Each chunk is a list of compact results. Iteration ends after the last chunk; a
+    superseded or failed request ends with its ``SUPERSEDED`` or error dict instead.
+    """
 
-class SearchWorker:
     def __init__(self):
-        self.request_q: multiprocessing.Queue = multiprocessing.Queue()
+        self._lock = threading.Lock()
+        self._chunks: List[Future] = [Future()]
+        self._finished = False
+
+    def done(self) -> bool:
+        """True once the last chunk has arrived (it may not have been consumed yet)."""
+        return self._finished
+
+    def feed(self, result: Any, more: bool = False):
+        with self._lock:
+            if self._finished:
+                return
+            future = self._chunks[-1]
+            if more:
+                self._chunks.append(Future())
+            else:
+                self._finished = True
+        future.set_result((result, more))
+
+    def set_result(self, result: Any):
+        """Finish the stream with ``result``; lets the client fail or supersede it like a Future."""
+        self.feed(result)
+
+    def __iter__(self):
+        position = 0
+        while True:
+            result, more = self._chunks[position].result()
+            yield unpack_results(result)
+            if not more:
+                return
+            position += 1
+
+    async def __aiter__(self):
+        position = 0
+        while True:
+            result, more = await asyncio.wrap_future(self._chunks[position])
+            yield unpack_results(result)
+            if not more:
+                return
+            position += 1
+
+
+def _worker_main(worker_id: int, request_q: multiprocessing.Queue, response_q: multiprocessing.Queue, options: Dict[str, Any]):
+    # Imported here so the index, NumPy and the model are only ever loaded in the worker process.
+    from worker import WorkerLoop
+    WorkerLoop(worker_id, request_q, response_q, options).run()
+
+
+class SearchWorker:
+    """Client for one or more search worker processes.
+
+    With ``processes > 1`` requests are spread over a pool: a session's query goes to
+    the worker still holding that session's previous query (so it can be superseded
+    there), anything else to the healthy worker with the fewest requests in flight.
+    With ``share_memory`` the first worker publishes its normalized embedding matrix
+    to shared memory and the others attach to it rather than loading their own.
+    """
+
+    def __init__(self, embedding_cache_size: int = 256, result_cache_size: int = 128,
+                 batch_size: int = 16, batch_window_ms: float = 5.0,
+                 use_ann: bool = False, ann_nprobe: int = 8,
+                 quantization: Optional[str] = None, rerank_factor: int = 4,
+                 processes: int = 1, share_memory: bool = False, watch_interval: float = 0.0):
+        self.options: Dict[str, Any] = {
+            'embedding_cache_size': embedding_cache_size,
+            'result_cache_size': result_cache_size,
+            'batch_size': max(1, batch_size),
+            'batch_window': batch_window_ms / 1000,
+            'use_ann': use_ann,
+            'ann_nprobe': ann_nprobe,
+            'quantization': quantization,
+            'rerank_factor': rerank_factor,
+            'share_memory': share_memory and processes > 1,
+            'watch_interval': watch_interval,
+        }
+        self.processes = max(1, processes)
+        self._shared_handle = None
+        self._shared_forwarded = False
         self.response_q: multiprocessing.Queue = multiprocessing.Queue()
-        self.proc = multiprocessing.Process(target=self._worker, daemon=True)
-        self.proc.start()
+        self.request_qs: List[multiprocessing.Queue] = [multiprocessing.Queue() for _ in range(self.processes)]
+        self.procs: List[multiprocessing.Process] = [
+            multiprocessing.Process(target=_worker_main, args=(worker_id, request_q, self.response_q, self.options),
+                                    name=f"SearchWorker-{worker_id}", daemon=True)
+            for worker_id, request_q in enumerate(self.request_qs)
+        ]
+        for proc in self.procs:
+            proc.start()
+
+        # Client-side multiplexing: every request carries an id and a single dispatcher
+        # thread resolves the matching future, so overlapping callers never swap replies.
+        self._pending: Dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+        self._session_latest: Dict[str, int] = {}
+        self._assigned: Dict[int, int] = {}
+        self._inflight: List[int] = [0] * self.processes
+        self._healthy: List[bool] = [True] * self.processes
+        self._round_robin = itertools.count()
+        self._failure: Optional[Dict[str, Any]] = None
+        self._statuses: List[Optional[Dict[str, Any]]] = [None] * self.processes
+        self._ready: Future = Future()
+        self._closed = threading.Event()
+        self._closing = False
+        self._dispatcher = threading.Thread(target=self._dispatch_responses, name="SearchWorkerDispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def _dispatch_responses(self):
+        """Route each reply on ``response_q`` to the future of the request with the same id."""
+        next_check = time.monotonic() + _HEALTH_CHECK_S
+        while not self._closed.is_set():
+            try:
+                reply = self.response_q.get(timeout=_HEALTH_CHECK_S)
+            except queue.Empty:
+                reply = None
+            # Checked on a timer, not only when idle, so steady traffic can't hide a dead worker.
+            if time.monotonic() >= next_check:
+                self._check_health()
+                next_check = time.monotonic() + _HEALTH_CHECK_S
+            if reply is None:
+                continue
+            if 'shared_index' in reply:
+                self._forward_shared_index(reply['shared_index'])
+                continue
+            if 'reloaded' in reply:
+                self._forward_reload(reply['reloaded'])
+                continue
+            if 'status' in reply:
+                self._record_status(reply['status'])
+                continue
+            if reply.get('id') is None:
+                # Replies without an id are worker-level failures such as load_failed.
+                self._mark_unhealthy(reply.get('worker', 0), reply)
+                continue
+            more = reply.get('more', False)
+            with self._pending_lock:
+                # A streamed request stays pending until its last chunk.
+                future = self._pending.get(reply['id']) if more else self._pop_request(reply['id'])
+            if future is None or future.done():
+                continue
+            if isinstance(future, ResultStream):
+                future.feed(reply.get('result'), more)
+            else:
+                future.set_result(reply.get('result'))
 
-    def _worker(self):
+    def _forward_shared_index(self, handle):
+        """Tell the waiting workers to attach to the published matrix, or to load their own (None)."""
+        if self._shared_forwarded:
+            return
+        self._shared_forwarded = True
+        self._shared_handle = handle
+        for request_q in self.request_qs[1:]:
+            request_q.put({'type': 'attach', 'shared_index': handle})
+
+    def _forward_reload(self, reloaded: Dict[str, Any]):
+        """Have the other workers of a shared-memory pool follow SearchWorker-0 onto its reloaded index."""
+        if reloaded.get('shared_index'):
+            # SearchWorker-0 already unlinked the previous block.
+            self._shared_handle = reloaded['shared_index']
+        for worker_id in range(1, self.processes):
+            if self._healthy[worker_id]:
+                self.request_qs[worker_id].put({'type': 'follow_reload', **reloaded})
+
+    def _record_status(self, status: Dict[str, Any]):
+        import logging
+        timings = ', '.join(f"{phase} {seconds:.2f}s" for phase, seconds in status.get('timings', {}).items())
+        logging.info(f"SearchWorker-{status.get('worker')} ready with {status.get('rows')} rows, "
+                     f"model {status.get('model')} ({timings}).")
+        self._statuses[status.get('worker', 0)] = status
+        if status.get('ready') and not self._ready.done():
+            self._ready.set_result(status)
+
+    def _pop_request(self, request_id: int) -> Optional[Future]:
+        """Forget a request and release its worker slot; call with ``_pending_lock`` held."""
+        worker_id = self._assigned.pop(request_id, None)
+        if worker_id is not None:
+            self._inflight[worker_id] -= 1
+        return self._pending.pop(request_id, None)
+
+    def _check_health(self):
+        for worker_id, proc in enumerate(self.procs):
+            if self._healthy[worker_id] and not proc.is_alive():
+                self._mark_unhealthy(worker_id, {'error': 'worker_exited'})
+
+    def _mark_unhealthy(self, worker_id: int, error: Dict[str, Any]):
+        """Take a worker out of rotation and fail its requests; fail everything once none are left."""
         import logging
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-        logging.info("SearchWorker process started. Attempting to load model and data...")
-        success = load_data_and_model()
-        if not success:
-            logging.error("SearchWorker failed to load model/data. Returning error to main process.")
-            self.response_q.put({'error': 'load_failed'})
+        if self._closing:
+            # Workers exit on purpose during close(), which fails whatever is still pending.
             return
-        logging.info("SearchWorker successfully loaded model and data.")
-        while True:
-            message = self.request_q.get()
-            logging.info(f"SearchWorker received message: {message}")
-            if message.get('type') == 'stop':
-                logging.info("SearchWorker received stop signal. Exiting.")
-                break
-            query = message.get('query', '')
-            if query.lower().startswith('tag:'):
-                tag = query.split(':', 1)[1]
-                results = search.perform_tag_filter(tag)
-            elif query:
-                results = search.perform_search(query)
-            else:
-                results = search.get_default_results()
-            logging.info(f"SearchWorker sending {len(results) if isinstance(results, list) else 'error'} results back.")
-            self.response_q.put(results)
+        logging.error(f"SearchWorker-{worker_id} is unavailable: {error.get('error')}")
+        self._statuses[worker_id] = dict(error, worker=worker_id, ready=False)
+        if worker_id == 0 and self.options['share_memory']:
+            # The publisher is gone; let the other workers load the matrix and reload by themselves.
+            self._forward_shared_index(None)
+            for follower in range(1, self.processes):
+                if self._healthy[follower]:
+                    self.request_qs[follower].put({'type': 'publisher_lost'})
+        with self._pending_lock:
+            self._healthy[worker_id] = False
+            orphaned = [request_id for request_id, assigned in self._assigned.items() if assigned == worker_id]
+            failed = [self._pop_request(request_id) for request_id in orphaned]
+            if not any(self._healthy):
+                self._failure = error
+                failed.extend(self._pending.values())
+                failed.append(self._ready)
+                self._pending.clear()
+        for future in failed:
+            if future is not None and not future.done():
+                future.set_result(error)
+
+    def _fail_pending(self, error: Dict[str, Any]):
+        with self._pending_lock:
+            self._failure = error
+            pending = list(self._pending.values()) + [self._ready]
+            self._pending.clear()
+            self._assigned.clear()
+        for future in pending:
+            if not future.done():
+                future.set_result(error)
+
+    def _pick_worker(self, session: Optional[str]) -> int:
+        """Choose a worker for a new request; call with ``_pending_lock`` held."""
+        if session is not None:
+            previous = self._session_latest.get(session)
+            worker_id = self._assigned.get(previous) if previous is not None else None
+            if worker_id is not None and self._healthy[worker_id]:
+                return worker_id
+        start = next(self._round_robin) % self.processes
+        healthy = [worker_id for worker_id in range(self.processes) if self._healthy[worker_id]]
+        # Least loaded first; ties rotate so idle workers share the traffic.
+        return min(healthy, key=lambda worker_id: (self._inflight[worker_id], (worker_id - start) % self.processes))
+
+    def _submit(self, message: Dict[str, Any], worker_id: Optional[int] = None, stream: bool = False) -> Future:
+        future = ResultStream() if stream else Future()
+        superseded: Optional[Future] = None
+        with self._pending_lock:
+            if self._failure is not None:
+                future.set_result(self._failure)
+                return future
+            session = message.get('session')
+            if worker_id is None:
+                worker_id = self._pick_worker(session)
+            request_id = next(self._request_ids)
+            self._pending[request_id] = future
+            self._assigned[request_id] = worker_id
+            self._inflight[worker_id] += 1
+            if session is not None:
+                previous = self._session_latest.get(session)
+                superseded = self._pop_request(previous) if previous is not None else None
+                self._session_latest[session] = request_id
+        if superseded is not None and not superseded.done():
+            # The caller waiting on the older query gets its answer now; the worker skips it if still queued.
+            superseded.set_result(dict(SUPERSEDED))
+        message['id'] = request_id
+        self.request_qs[worker_id].put(message)
+        return future
+
+    def search(self, query: str, session: Optional[str] = None, compact: bool = False,
+               offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Run a query and return rows ``offset`` to ``offset + limit`` of its results.
+
+        A later query with the same ``session`` supersedes this one if it has not finished
+        yet, in which case ``{'superseded': True}`` is returned. With ``compact`` the worker
+        sends row ids and card fields only (see ``unpack_results``). A page shorter than
+        ``limit`` is the last one.
+        """
+        return unpack_results(self._submit(_search_message(query, session, compact, offset, limit)).result())
+
+    async def asearch(self, query: str, session: Optional[str] = None, compact: bool = False,
+                      offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Awaitable ``search``: no thread is held while the worker computes the reply."""
+        return unpack_results(await asyncio.wrap_future(self._submit(_search_message(query, session, compact, offset, limit))))
+
+    def search_stream(self, query: str, session: Optional[str] = None, first_page: int = 10,
+                      offset: int = 0, limit: Optional[int] = None) -> ResultStream:
+        """Run a query and receive a page of compact results in chunks: the first ``first_page``
+        rows as soon as ranking finishes, then the rest. Supersession works as for ``search``."""
+        message = _search_message(query, session, True, offset, limit)
+        message['first_page'] = max(1, first_page)
+        return self._submit(message, stream=True)
+
+    def related(self, metadata_id: str, count: int = 4, compact: bool = False) -> List[Dict[str, Any]]:
+        """Packages most similar to the one with ``metadata_id``, computed where the index lives."""
+        message = {'type': 'related', 'metadata_id': metadata_id, 'count': count, 'compact': compact}
+        return unpack_results(self._submit(message).result())
+
+    async def arelated(self, metadata_id: str, count: int = 4, compact: bool = False) -> List[Dict[str, Any]]:
+        """Awaitable ``related``."""
+        message = {'type': 'related', 'metadata_id': metadata_id, 'count': count, 'compact': compact}
+        return unpack_results(await asyncio.wrap_future(self._submit(message)))
+
+    def details(self, metadata_id: str) -> Optional[Dict[str, Any]]:
+        """The full record behind a compact result, or None if the id is unknown."""
+        return self._submit({'type': 'details', 'metadata_id': metadata_id}).result()
+
+    async def adetails(self, metadata_id: str) -> Optional[Dict[str, Any]]:
+        """Awaitable ``details``."""
+        return await asyncio.wrap_future(self._submit({'type': 'details', 'metadata_id': metadata_id}))
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness as last reported by the workers, answered locally so it is cheap to poll.
+
+        Each worker entry carries its load timings (data.json parse, index unpickle or
+        open, index build and, once loaded, model load), row count, generation, top tags
+        and model state. A worker is ready before its model is: until ``model_ready``,
+        semantic queries are answered with keyword matches flagged ``__lexical``.
+        """
+        workers = [status or {'worker': worker_id, 'ready': False} for worker_id, status in enumerate(self._statuses)]
+        return {
+            'ready': any(worker.get('ready') for worker in workers),
+            'model_ready': any(worker.get('model') == 'ready' for worker in workers),
+            'workers': workers,
+            'error': self._failure,
+        }
+
+    def refresh_status(self) -> Dict[str, Any]:
+        """Ask every healthy worker for its current status, then return ``status()``."""
+        futures = [self._submit({'type': 'status'}, worker_id=worker_id)
+                   for worker_id in range(self.processes) if self._healthy[worker_id]]
+        for future in futures:
+            result = future.result()
+            if isinstance(result, dict) and 'worker' in result:
+                self._statuses[result['worker']] = result
+        return self.status()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Block until a worker is ready; returns its status, or an error dict if none can load."""
+        return self._ready.result(timeout)
+
+    async def aready(self) -> Dict[str, Any]:
+        """Awaitable ``wait_ready``."""
+        return await asyncio.wrap_future(self._ready)
+
+    def reload(self) -> Dict[str, Any]:
+        """Rebuild data.json and the index in the background and swap them in once built.
+
+        Queries keep being answered from the current data meanwhile. In a shared-memory
+        pool SearchWorker-0 reloads and republishes the matrix, and the others attach to it
+        (or reload on their own once SearchWorker-0 has died).
+        Returns the new status (per worker under ``'workers'`` for a pool), or
+        ``{'error': 'reload_failed'}``.
+        """
+        if self.processes == 1:
+            return self._submit({'type': 'reload'}).result()
+        futures = [self._submit({'type': 'reload'}, worker_id=worker_id)
+                   for worker_id in range(self.processes) if self._healthy[worker_id]]
+        return {'workers': [future.result() for future in futures]}
+
+    async def areload(self) -> Dict[str, Any]:
+        """Awaitable ``reload``."""
+        return await asyncio.to_thread(self.reload)
 
-    def search(self, query: str) -> List[Dict[str, Any]]:
-        self.request_q.put({'type': 'search', 'query': query})
-        return self.response_q.get()
+    def stats(self) -> Dict[str, Any]:
+        """Return the worker's cache counters; a pool returns them per worker under ``'workers'``."""
+        if self.processes == 1:
+            return self._submit({'type': 'stats'}).result()
+        futures = [self._submit({'type': 'stats'}, worker_id=worker_id)
+                   for worker_id in range(self.processes) if self._healthy[worker_id]]
+        return {'workers': [future.result() for future in futures]}
 
-    def close(self):
-        self.request_q.put({'type': 'stop'})
-        self.proc.join()
+    def close(self, timeout: float = 5.0):
+        self._closing = True
+        for proc, request_q in zip(self.procs, self.request_qs):
+            if proc.is_alive():
+                request_q.put({'type': 'stop'})
+        for proc in self.procs:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        self._closed.set()
+        self._dispatcher.join(timeout=1)
+        if self._shared_handle:
+            from shared import unlink_handle
+            unlink_handle(self._shared_handle)
+        self._fail_pending({'error': 'worker_closed'})
@@ -0,0 +1,214 @@
+"""Precomputed k-nearest-neighbour graph for "You might also like".
+
+Every row's top-k most similar rows are stored as int32 ids with float16 scores in
+``vector_index.knn.npz`` next to the vector index, so a related lookup is an array
+read. Rebuilds are incremental: rows whose embedding did not change keep their
+lists, merged with scores against the changed rows only::
+
+    python knn.py build --k 16
+"""
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ann import matrix_fingerprint
+from scoring import ScoringEngine
+
+DEFAULT_INDEX_FILE = "vector_index.pkl"
+DEFAULT_KNN_FILE = "vector_index.knn.npz"
+
+
+def row_fingerprints(matrix: np.ndarray) -> np.ndarray:
+    """64-bit hash of every row's bytes, used to find rows whose embedding changed."""
+    out = np.empty(matrix.shape[0], dtype=np.uint64)
+    for row in range(matrix.shape[0]):
+        out[row] = int.from_bytes(hashlib.blake2b(matrix[row].tobytes(), digest_size=8).digest(), 'little')
+    return out
+
+
+def _chunk_rows(n_columns: int, budget: int = 1 << 25) -> int:
+    """Rows per block so a block of scores stays around ``budget`` float32 values."""
+    return max(1, budget // max(1, n_columns))
+
+
+def _top_k_rows(scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise top-k of a (rows, candidates) score block; ``ids`` maps columns to row ids."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    best = np.take_along_axis(part, order, axis=1)
+    best_ids = np.take_along_axis(ids, best, axis=1) if ids.ndim == 2 else ids[best]
+    return best_ids, np.take_along_axis(part_scores, order, axis=1)
+
+
+def exact_neighbors(matrix: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact top-k neighbours (excluding the row itself) for ``rows``, scanned in blocks."""
+    neighbors = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.zeros((len(rows), k), dtype=np.float32)
+    all_ids = np.arange(matrix.shape[0], dtype=np.int32)
+    step = _chunk_rows(matrix.shape[0])
+    for start in range(0, len(rows), step):
+        block_rows = rows[start:start + step]
+        block = matrix[block_rows] @ matrix.T
+        block[np.arange(len(block_rows)), block_rows] = -np.inf
+        ids, best = _top_k_rows(block, all_ids, k)
+        ids[np.isneginf(best)] = -1
+        neighbors[start:start + len(block_rows), :ids.shape[1]] = ids
+        scores[start:start + len(block_rows), :best.shape[1]] = best
+    return neighbors, scores
+
+
+class KNNGraph:
+    """Top-k neighbour lists per row, addressed by the rows of the live index.
+
+    The file stores its own metadata ids, so rows are matched to the live index by id;
+    rows the graph does not know about fall back to an exact scan in the caller.
+    """
+
+    def __init__(self, neighbors: np.ndarray, scores: np.ndarray, metadata: List[str],
+                 fingerprints: np.ndarray, matrix_print: str = ''):
+        self.neighbors = np.asarray(neighbors, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float16)
+        self.metadata = list(metadata)
+        self.fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        self.matrix_print = matrix_print
+        self._graph_row: Optional[np.ndarray] = None
+        self._live_row: Optional[np.ndarray] = None
+        self.stale_rows = 0
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1]
+
+    def __len__(self) -> int:
+        return self.neighbors.shape[0]
+
+    def bind(self, metadata_ids: List[str], matrix: Optional[np.ndarray] = None) -> int:
+        """Map graph rows to live index rows by metadata id; return how many live rows are covered.
+
+        With ``matrix`` (the live normalized embeddings) that differs from the one the
+        graph was built from, rows whose embedding no longer matches the graph's
+        fingerprint, and rows listing such a neighbour, are left uncovered so they fall
+        back to an exact scan.
+        """
+        graph_row_by_id = {metadata_id: row for row, metadata_id in enumerate(self.metadata)}
+        self._graph_row = np.full(len(metadata_ids), -1, dtype=np.int64)
+        self._live_row = np.full(len(self), -1, dtype=np.int64)
+        for live_row, metadata_id in enumerate(metadata_ids):
+            graph_row = graph_row_by_id.get(metadata_id, -1)
+            self._graph_row[live_row] = graph_row
+            if graph_row >= 0:
+                self._live_row[graph_row] = live_row
+        # The sampled matrix print is cheap; hashing every row would page in a memory-mapped matrix.
+        if matrix is not None and len(self) and self.matrix_print != matrix_fingerprint(matrix):
+            mapped = np.flatnonzero(self._graph_row >= 0)
+            graph_rows = self._graph_row[mapped]
+            changed = graph_rows[self.fingerprints[graph_rows] != row_fingerprints(matrix)[mapped]]
+            self._live_row[changed] = -1
+            stale = np.zeros(len(self), dtype=bool)
+            stale[changed] = True
+            ids = self.neighbors
+            stale |= ((ids >= 0) & stale[np.maximum(ids, 0)]).any(axis=1)
+            self._graph_row[mapped[stale[graph_rows]]] = -1
+            self.stale_rows = int(stale.sum())
+        return int((self._graph_row >= 0).sum())
+
+    def neighbors_of(self, live_row: int, count: int) -> Optional[np.ndarray]:
+        """Up to ``count`` live row ids most similar to ``live_row``, or None if the graph can't answer."""
+        if self._graph_row is None or count > self.k or not 0 <= live_row < len(self._graph_row):
+            return None
+        graph_row = self._graph_row[live_row]
+        if graph_row < 0:
+            return None
+        ids = self.neighbors[graph_row]
+        live = self._live_row[ids[ids >= 0]]
+        live = live[live >= 0]
+        return live[:count] if len(live) >= count else None
+
+    def save(self, path: str) -> None:
+        np.savez(path, neighbors=self.neighbors, scores=self.scores, metadata=np.array(self.metadata),
+                 fingerprints=self.fingerprints, matrix_print=np.array(self.matrix_print))
+
+    @classmethod
+    def load(cls, path: str) -> "KNNGraph":
+        with np.load(path) as data:
+            return cls(data['neighbors'], data['scores'], data['metadata'].tolist(),
+                       data['fingerprints'], str(data['matrix_print']))
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, metadata: List[str], k: int = 16,
+              previous: Optional["KNNGraph"] = None) -> "KNNGraph":
+        """Build the graph, reusing ``previous`` for rows whose embedding and neighbours are unchanged."""
+        n = matrix.shape[0]
+        k = max(1, min(k, n - 1)) if n > 1 else 1
+        fingerprints = row_fingerprints(matrix)
+        neighbors = np.full((n, k), -1, dtype=np.int32)
+        scores = np.zeros((n, k), dtype=np.float32)
+        recompute = np.ones(n, dtype=bool)
+
+        if previous is not None and previous.k >= k and len(previous):
+            old_row_by_id = {metadata_id: row for row, metadata_id in enumerate(previous.metadata)}
+            old_row = np.array([old_row_by_id.get(metadata_id, -1) for metadata_id in metadata], dtype=np.int64)
+            unchanged = (old_row >= 0) & (previous.fingerprints[np.maximum(old_row, 0)] == fingerprints)
+            # Translate old neighbour ids into current rows; a changed or removed neighbour invalidates a list.
+            old_to_new = np.full(len(previous), -1, dtype=np.int64)
+            old_to_new[old_row[unchanged]] = np.flatnonzero(unchanged)
+            candidates = np.flatnonzero(unchanged)
+            old_ids = previous.neighbors[old_row[candidates], :k]
+            translated = np.where(old_ids >= 0, old_to_new[np.maximum(old_ids, 0)], -1)
+            intact = (translated >= 0).all(axis=1)
+            keep = candidates[intact]
+            changed = np.flatnonzero(~unchanged)
+            if len(keep) and len(changed) < n // 2:
+                neighbors[keep] = translated[intact]
+                scores[keep] = previous.scores[old_row[keep], :k].astype(np.float32)
+                recompute[keep] = False
+                if len(changed):
+                    changed_vectors = matrix[changed]
+                    step = _chunk_rows(len(changed) + k)
+                    for start in range(0, len(keep), step):
+                        block_rows = keep[start:start + step]
+                        merged_scores = np.hstack([scores[block_rows], matrix[block_rows] @ changed_vectors.T])
+                        merged_ids = np.hstack([neighbors[block_rows], np.broadcast_to(changed, (len(block_rows), len(changed)))])
+                        ids, best = _top_k_rows(merged_scores, merged_ids, k)
+                        neighbors[block_rows] = ids
+                        scores[block_rows] = best
+                logging.info(f"Reused neighbour lists for {len(keep)} of {n} rows; {len(changed)} rows changed.")
+
+        rows = np.flatnonzero(recompute)
+        if len(rows):
+            neighbors[rows], scores[rows] = exact_neighbors(matrix, rows, k)
+        return cls(neighbors, scores, metadata, fingerprints, matrix_fingerprint(matrix))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the related-packages neighbour graph.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--index", default=DEFAULT_INDEX_FILE, help="vector index pickle to read")
+    parser.add_argument("--output", default=DEFAULT_KNN_FILE, help="graph file to update or write")
+    parser.add_argument("--k", type=int, default=16, help="neighbours stored per row")
+    parser.add_argument("--full", action="store_true", help="ignore the existing graph and rebuild every row")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open(args.index, "rb") as f:
+        vector_index = pickle.load(f)
+    matrix = ScoringEngine(vector_index['embeddings']).matrix
+    previous = None
+    if not args.full and os.path.exists(args.output):
+        previous = KNNGraph.load(args.output)
+    started = time.perf_counter()
+    graph = KNNGraph.build(matrix, vector_index['metadata'], k=args.k, previous=previous)
+    graph.save(args.output)
+    logging.info(f"Wrote {len(graph)} x {graph.k} neighbour graph to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import bisect
+import itertools
+import re
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_DATE_RE = re.compile(r'\((\d+)\)')
+_WORD_RE = re.compile(r'\w+')
+
+# Tags shown on a result card; the full tag string comes with the details record.
+PREVIEW_TAGS = 3
+
+
+def parse_date_ms(date_str: Any) -> int:
+    """Parse a ``/Date(ms)/`` string into epoch milliseconds, 0 when missing or malformed."""
+    if not date_str:
+        return 0
+    match = _DATE_RE.search(str(date_str))
+    return int(match.group(1)) if match else 0
+
+
+class _PrefixIndex:
+    """Rows per lowercase word, words sorted so all words sharing a prefix are one run of ``rows``."""
+
+    def __init__(self, texts: Iterable[str]):
+        buckets: Dict[str, List[int]] = {}
+        for row, text in enumerate(texts):
+            for word in set(_WORD_RE.findall(text.lower())):
+                buckets.setdefault(word, []).append(row)
+        self.words = sorted(buckets)
+        self.offsets = np.zeros(len(self.words) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(buckets[word]) for word in self.words], dtype=np.int64), out=self.offsets[1:])
+        self.rows = np.fromiter(itertools.chain.from_iterable(buckets[word] for word in self.words),
+                                dtype=np.int32, count=int(self.offsets[-1]))
+
+    def matching(self, prefix: str, n_rows: int) -> np.ndarray:
+        """Boolean mask of the rows holding a word that starts with ``prefix``."""
+        lo = bisect.bisect_left(self.words, prefix)
+        hi = bisect.bisect_left(self.words, prefix + chr(0x10FFFF))
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[self.rows[self.offsets[lo]:self.offsets[hi]]] = True
+        return mask
+
+
+class RowTable:
+    """Result rows for every index entry, parsed and assembled once at load time.
+
+    Row ``i`` corresponds to ``VECTOR_INDEX['metadata'][i]`` and to row ``i`` of the
+    embedding matrix, so ranked row ids can be turned into results with a gather.
+    Only columns are kept; full result dicts are built from ``software_data`` on request.
+    ``updated_ms`` may pass in a precomputed timestamp column (see ``index_store``)
+    instead of parsing every LastUpdated string.
+    """
+
+    def __init__(self, metadata_ids: List[str], software_data: Dict[str, Any], updated_ms: Optional[np.ndarray] = None):
+        n = len(metadata_ids)
+        self.metadata_ids: List[str] = list(metadata_ids)
+        self.keys: List[Optional[str]] = [None] * n
+        self.version_idx = np.full(n, -1, dtype=np.int32)
+        self.valid = np.zeros(n, dtype=bool)
+        self.titles: List[str] = [''] * n
+        self.versions: List[str] = [''] * n
+        self.summaries: List[str] = [''] * n
+        self.tags: List[str] = [''] * n
+        self.updated_ms = np.zeros(n, dtype=np.int64)
+        self._software_data = software_data
+        self.row_by_id: Dict[str, int] = {}
+        self._keyword_index: Optional[Tuple[_PrefixIndex, _PrefixIndex]] = None
+
+        for row, metadata_id in enumerate(self.metadata_ids):
+            # First occurrence wins, matching list.index on the metadata list.
+            self.row_by_id.setdefault(metadata_id, row)
+            try:
+                key, version_idx_str = metadata_id.split('::')
+                version_idx = int(version_idx_str)
+                software_info = software_data[key]
+                version_data = software_info['Versions'][version_idx]
+            except (KeyError, IndexError, ValueError, TypeError, AttributeError):
+                continue
+            title = software_info.get('Title', key)
+            self.keys[row] = key
+            self.version_idx[row] = version_idx
+            self.valid[row] = True
+            self.titles[row] = title
+            self.versions[row] = version_data.get('Version') or ''
+            self.summaries[row] = version_data.get('Summary') or ''
+            self.tags[row] = version_data.get('Tags') or ''
+            if updated_ms is None:
+                self.updated_ms[row] = parse_date_ms(version_data.get('LastUpdated'))
+
+        if updated_ms is not None:
+            self.updated_ms[self.valid] = np.asarray(updated_ms, dtype=np.int64)[self.valid]
+
+        # Resolved rows, most recently updated first (ties keep index order).
+        valid_rows = np.flatnonzero(self.valid)
+        self.recency_order = valid_rows[np.argsort(-self.updated_ms[valid_rows], kind='stable')]
+        self._recency_neg_ms = -self.updated_ms[self.recency_order]
+
+    def __len__(self) -> int:
+        return len(self.metadata_ids)
+
+    def row_of(self, metadata_id: Optional[str]) -> Optional[int]:
+        """Return the row position of ``metadata_id`` in constant time, or None."""
+        return self.row_by_id.get(metadata_id) if metadata_id else None
+
+    def updated_between(self, start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> np.ndarray:
+        """Row ids updated within [start_ms, end_ms], most recent first, as a slice of the recency order."""
+        lo = 0 if end_ms is None else int(np.searchsorted(self._recency_neg_ms, -end_ms, side='left'))
+        hi = len(self.recency_order) if start_ms is None else int(np.searchsorted(self._recency_neg_ms, -start_ms, side='right'))
+        return self.recency_order[lo:hi]
+
+    def record(self, row: int) -> Optional[Dict[str, Any]]:
+        """The full result dict for ``row``, built from the catalog entry, or None if it has no data."""
+        key = self.keys[row]
+        if key is None:
+            return None
+        record = dict(self._software_data[key]['Versions'][int(self.version_idx[row])])
+        record['SoftwareTitle'] = self.titles[row]
+        record['__metadata_id'] = self.metadata_ids[row]
+        return record
+
+    def gather(self, row_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """Return the result dicts for ``row_ids`` in order, skipping rows with no data."""
+        return [record for record in map(self.record, row_ids) if record is not None]
+
+    def keyword_scores(self, terms: List[str]) -> np.ndarray:
+        """Score rows by lowercase query terms: 2 per term in the title, 1 per term only in the summary or tags.
+
+        A term matches a field when each of its words starts a word there, so partly typed
+        words match as well.
+        """
+        if self._keyword_index is None:
+            # Built on first use; only needed while the semantic model is unavailable.
+            self._keyword_index = (_PrefixIndex(self.titles),
+                                   _PrefixIndex(f"{summary}\n{tags}" for summary, tags in zip(self.summaries, self.tags)))
+        titles, texts = self._keyword_index
+        n = len(self)
+        scores = np.zeros(n, dtype=np.float32)
+        for term in terms:
+            words = _WORD_RE.findall(term.lower())
+            if not words:
+                continue
+            in_title = np.logical_and.reduce([titles.matching(word, n) for word in words])
+            in_text = np.logical_and.reduce([texts.matching(word, n) for word in words])
+            scores += np.where(in_title, 2.0, np.where(in_text, 1.0, 0.0)).astype(np.float32)
+        scores[~self.valid] = 0
+        return scores
+
+    def compact(self, row_ids: Iterable[int], scores: Optional[Iterable[float]] = None) -> Dict[str, Any]:
+        """Pack ``row_ids`` (and their scores) into parallel columns for a small IPC reply.
+
+        Numeric columns are stdlib ``array``s so the receiving process needs no NumPy;
+        rows with no data are skipped, like ``gather``.
+        """
+        ids = np.asarray(row_ids, dtype=np.int64)
+        keep = self.valid[ids] if len(ids) else np.zeros(0, dtype=bool)
+        ids = ids[keep]
+        score_column = np.asarray(scores, dtype=np.float32)[keep] if scores is not None else np.zeros(len(ids), dtype=np.float32)
+        rows = ids.tolist()
+        return {
+            'rows': array('i', rows),
+            'scores': array('f', score_column.tolist()),
+            'updated_ms': array('q', self.updated_ms[ids].tolist()),
+            'metadata_id': [self.metadata_ids[row] for row in rows],
+            'title': [self.titles[row] for row in rows],
+            'version': [self.versions[row] for row in rows],
+            'summary': [self.summaries[row] for row in rows],
+            'tags': [' '.join(self.tags[row].split()[:PREVIEW_TAGS]) for row in rows],
+        }
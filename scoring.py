@@ -0,0 +1,130 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def select_top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the k highest scores, best first."""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class QuantizedScan:
+    """Reduced-precision copy of a normalized matrix, used only to shortlist candidates.
+
+    ``float16`` halves the bytes read per query; ``int8`` stores each dimension
+    scaled by its own max magnitude and quarters them. Chunks are widened to
+    float32 on the fly so the product still runs through BLAS.
+    """
+
+    MODES = ('float16', 'int8')
+
+    def __init__(self, matrix: np.ndarray, mode: str, chunk_size: int = 4096):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown quantization mode {mode!r}; expected one of {self.MODES}")
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.scale: Optional[np.ndarray] = None
+        if mode == 'float16':
+            self.data = matrix.astype(np.float16)
+            return
+        scale = np.abs(matrix).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        self.data = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, matrix.shape[0], chunk_size):
+            block = matrix[start:start + chunk_size] / self.scale
+            self.data[start:start + chunk_size] = np.clip(np.rint(block), -127, 127)
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine scores of a normalized query against every row."""
+        # Folding the per-dimension scale into the query keeps the scan a plain product.
+        query = query * self.scale if self.scale is not None else query
+        out = np.empty(self.data.shape[0], dtype=np.float32)
+        for start in range(0, self.data.shape[0], self.chunk_size):
+            out[start:start + self.chunk_size] = self.data[start:start + self.chunk_size].astype(np.float32) @ query
+        return out
+
+
+class ScoringEngine:
+    """Cosine scoring against an embedding matrix that is L2-normalized once at load."""
+
+    scan: Optional[QuantizedScan] = None
+    rerank_factor = 4
+
+    def __init__(self, embeddings, quantization: Optional[str] = None, rerank_factor: int = 4):
+        matrix = np.array(embeddings, dtype=np.float32, order='C', copy=True)
+        if matrix.ndim != 2:
+            raise ValueError(f"Expected a 2-D embedding matrix, got shape {matrix.shape}")
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        self.matrix = matrix
+        if quantization:
+            self.quantize(quantization, rerank_factor)
+
+    @classmethod
+    def from_normalized(cls, matrix: np.ndarray) -> "ScoringEngine":
+        """Wrap a matrix whose rows are already L2-normalized float32, without copying it."""
+        engine = cls.__new__(cls)
+        engine.matrix = matrix
+        return engine
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def quantize(self, mode: str, rerank_factor: int = 4) -> "ScoringEngine":
+        """Scan a quantized copy of the matrix and re-rank a shortlist of ``k * rerank_factor``
+        rows against the full-precision vectors, so the final top-k order is exact."""
+        self.scan = QuantizedScan(self.matrix, mode)
+        self.rerank_factor = max(1, rerank_factor)
+        return self
+
+    @staticmethod
+    def normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def score(self, query_vector) -> np.ndarray:
+        """Cosine similarity of one query against every row (one matrix-vector product)."""
+        return self.matrix @ self.normalize(query_vector)
+
+    def top_k(self, query_vector, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row ids, scores) of the k most similar rows, best first."""
+        if self.scan is not None:
+            query = self.normalize(query_vector)
+            shortlist = select_top_k(self.scan.scores(query), k * self.rerank_factor)
+            exact = self.matrix[shortlist] @ query
+            best = select_top_k(exact, k)
+            return shortlist[best], exact[best]
+        scores = self.score(query_vector)
+        ids = select_top_k(scores, k)
+        return ids, scores[ids]
+
+    def top_k_batch(self, query_vectors, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """``top_k`` for a batch of queries, scored with a single matrix-matrix product."""
+        if self.scan is not None:
+            return [self.top_k(query, k) for query in query_vectors]
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = (queries / norms) @ self.matrix.T
+        results = []
+        for row_scores in scores:
+            ids = select_top_k(row_scores, k)
+            results.append((ids, row_scores[ids]))
+        return results
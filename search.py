@@ -1,153 +1,152 @@
-import re
-import data_loader
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 import data_loader
+from cache import LRUCache
+from scoring import select_top_k
+
+# Row ids in rank order, with their similarity scores when the ranking has them.
+Ranking = Tuple[np.ndarray, Optional[np.ndarray]]
+
+# Query embeddings keyed by normalized query text; replaced by the worker with its configured size.
+EMBEDDING_CACHE = LRUCache(256)
+
+# Rows per page of results; semantic rankings are computed in multiples of it.
+PAGE_SIZE = 50
+
+# Use the IVF index from ann.py when one is loaded; ANN_NPROBE trades recall for latency.
+ANN_ENABLED = False
+ANN_NPROBE = 8
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
 
-def perform_search(query: str) -> List[Dict[str, Any]]:
+def encode_queries(queries: List[str]) -> list:
+    """Embed several queries with one MODEL.encode call for the ones not already cached."""
+    # all-MiniLM-L6-v2 lowercases its input, so the normalized text embeds identically.
+    keys = [normalize_query(query) for query in queries]
+    embeddings = {}
+    missing = {}
+    for key in keys:
+        if key in embeddings or key in missing:
+            continue
+        cached = EMBEDDING_CACHE.get(key)
+        if cached is None:
+            missing[key] = None
+        else:
+            embeddings[key] = cached
+    if missing:
+        encoded = data_loader.MODEL.encode(list(missing), convert_to_tensor=False)
+        for key, embedding in zip(missing, encoded):
+            EMBEDDING_CACHE.put(key, embedding)
+            embeddings[key] = embedding
+    return [embeddings[key] for key in keys]
+
+def _search_ready() -> bool:
     import logging
-    logging.info(f"perform_search called with query: '{query}'")
-    if not query:
-        logging.warning("Query is empty.")
-        return []
     if not data_loader.MODEL:
         logging.error("MODEL is not loaded.")
-        return []
+        return False
     if not data_loader.VECTOR_INDEX:
         logging.error("VECTOR_INDEX is not loaded.")
-        return []
-    if not data_loader.SOFTWARE_DATA:
-        logging.error("SOFTWARE_DATA is not loaded.")
-        return []
-    query_embedding = data_loader.MODEL.encode(query, convert_to_tensor=False)
-    similarities = cosine_similarity([query_embedding], data_loader.VECTOR_INDEX['embeddings'])[0]
-    top_indices = np.argsort(similarities)[-50:][::-1]
-    results = []
-    for idx in top_indices:
-        if similarities[idx] > 0.3:
-            metadata_id = data_loader.VECTOR_INDEX['metadata'][idx]
-            key, version_idx_str = metadata_id.split('::')
-            version_idx = int(version_idx_str)
-            version_data = data_loader.SOFTWARE_DATA[key]['Versions'][version_idx].copy()
-            version_data['SoftwareTitle'] = data_loader.SOFTWARE_DATA[key]['Title']
-            version_data['__metadata_id'] = metadata_id
-            results.append(version_data)
-    logging.info(f"perform_search returning {len(results)} results.")
-    return results
+        return False
+    if data_loader.ENGINE is None or data_loader.ROWS is None:
+        logging.error("Scoring engine or row table is not built.")
+        return False
+    return True
 
-def perform_tag_filter(tag: str) -> List[Dict[str, Any]]:
-    tag_map = data_loader.VECTOR_INDEX.get("tag_map", {})
-    if not tag or not tag_map or not data_loader.SOFTWARE_DATA:
-        return []
-    lower_tag = tag.lower()
-    matching_ids = [metadata_id for metadata_id, tags in tag_map.items() if lower_tag in tags]
-    results = []
-    for metadata_id in matching_ids:
-        try:
-            key, version_idx_str = metadata_id.split('::')
-            version_idx = int(version_idx_str)
-            software_info = data_loader.SOFTWARE_DATA[key]
-            version_data = software_info['Versions'][version_idx]
-            result_item = version_data.copy()
-            result_item['SoftwareTitle'] = software_info.get('Title', key)
-            result_item['__metadata_id'] = metadata_id
-            results.append(result_item)
-        except (KeyError, IndexError, ValueError):
-            continue
-    return results
+def _rank(query_embedding, k: int):
+    """Top-k (row ids, scores) for one query, through the ANN index when it is enabled."""
+    if ANN_ENABLED and data_loader.ANN is not None:
+        return data_loader.ANN.search(data_loader.ENGINE.matrix, query_embedding, k, ANN_NPROBE)
+    return data_loader.ENGINE.top_k(query_embedding, k)
 
-def find_related_packages(target_pkg_data: dict, count: int = 4) -> List[Dict[str, Any]]:
-    target_metadata_id = target_pkg_data.get('__metadata_id')
-    if not target_metadata_id or not data_loader.MODEL or not data_loader.VECTOR_INDEX or not data_loader.SOFTWARE_DATA:
-        return []
-    try:
-        target_idx = data_loader.VECTOR_INDEX['metadata'].index(target_metadata_id)
-        target_embedding = data_loader.VECTOR_INDEX['embeddings'][target_idx]
-    except (ValueError, IndexError):
-        import logging
-        logging.warning(f"Could not find metadata_id {target_metadata_id} in index.")
-        return []
-    similarities = cosine_similarity([target_embedding], data_loader.VECTOR_INDEX['embeddings'])[0]
-    top_indices = np.argsort(similarities)[-(count+1):][::-1]
-    results = []
-    for idx in top_indices:
-        metadata_id = data_loader.VECTOR_INDEX['metadata'][idx]
-        if metadata_id == target_metadata_id:
-            continue
-        key, version_idx_str = metadata_id.split('::')
-        version_idx = int(version_idx_str)
-        version_data = data_loader.SOFTWARE_DATA[key]['Versions'][version_idx].copy()
-        version_data['SoftwareTitle'] = data_loader.SOFTWARE_DATA[key]['Title']
-        version_data['__metadata_id'] = metadata_id
-        results.append(version_data)
-        if len(results) == count:
-            break
-    return results
-    import data_loader
-    target_metadata_id = target_pkg_data.get('__metadata_id')
-    if not target_metadata_id or not data_loader.MODEL or not data_loader.VECTOR_INDEX or not data_loader.SOFTWARE_DATA:
-        return []
+def _no_hits():
+    return np.empty(0, dtype=np.intp), None
 
-    try:
-        target_idx = data_loader.VECTOR_INDEX['metadata'].index(target_metadata_id)
-        target_embedding = data_loader.VECTOR_INDEX['embeddings'][target_idx]
-    except (ValueError, IndexError):
-        import logging
-        logging.warning(f"Could not find metadata_id {target_metadata_id} in index.")
-        return []
+def slice_ranking(ranking: Ranking, start: int, stop: Optional[int] = None) -> Ranking:
+    row_ids, scores = ranking
+    return row_ids[start:stop], (scores[start:stop] if scores is not None else None)
 
-    similarities = cosine_similarity([target_embedding], data_loader.VECTOR_INDEX['embeddings'])[0]
-    top_indices = np.argsort(similarities)[-(count+1):][::-1]
+def rank_search_batch(queries: List[str], k: int = PAGE_SIZE) -> List[Ranking]:
+    """Top ``k`` (row ids, scores) above the similarity threshold for several queries at once:
+    one encode call and one matrix-matrix product. Fewer than ``k`` rows means there are no more."""
+    import logging
+    logging.info(f"rank_search_batch called with {len(queries)} queries.")
+    rankings: List[Ranking] = [_no_hits() for _ in queries]
+    positions = [i for i, query in enumerate(queries) if query]
+    if not positions or not _search_ready():
+        return rankings
+    embeddings = encode_queries([queries[i] for i in positions])
+    if ANN_ENABLED and data_loader.ANN is not None:
+        ranked = [_rank(embedding, k) for embedding in embeddings]
+    else:
+        ranked = data_loader.ENGINE.top_k_batch(embeddings, k)
+    for i, (top_indices, similarities) in zip(positions, ranked):
+        keep = similarities > 0.3
+        rankings[i] = (top_indices[keep], similarities[keep])
+    return rankings
 
-    results = []
-    for idx in top_indices:
-        metadata_id = data_loader.VECTOR_INDEX['metadata'][idx]
-        if metadata_id == target_metadata_id:
-            continue
+def rank_lexical(query: str, k: int = PAGE_SIZE) -> Ranking:
+    """Keyword ranking over titles, summaries and tags, served while the model is still loading."""
+    terms = normalize_query(query).split()
+    if not terms or data_loader.ROWS is None:
+        return _no_hits()
+    scores = data_loader.ROWS.keyword_scores(terms)
+    top_indices = select_top_k(scores, k)
+    keep = scores[top_indices] > 0
+    return top_indices[keep], scores[top_indices][keep]
 
-        key, version_idx_str = metadata_id.split('::')
-        version_idx = int(version_idx_str)
-        version_data = data_loader.SOFTWARE_DATA[key]['Versions'][version_idx].copy()
-        version_data['SoftwareTitle'] = data_loader.SOFTWARE_DATA[key]['Title']
-        version_data['__metadata_id'] = metadata_id
-        results.append(version_data)
+def rank_tag_filter(tag: str) -> Ranking:
+    if not tag or data_loader.TAGS is None:
+        return _no_hits()
+    return data_loader.TAGS.match(tag), None
 
-        if len(results) == count:
-            break
-    return results
+def rank_related(metadata_id: Optional[str], count: int = 4) -> Ranking:
+    if not metadata_id or data_loader.ENGINE is None or data_loader.ROWS is None:
+        return _no_hits()
+    target_idx = data_loader.ROWS.row_of(metadata_id)
+    if target_idx is None or target_idx >= len(data_loader.ENGINE):
+        import logging
+        logging.warning(f"Could not find metadata_id {metadata_id} in index.")
+        return _no_hits()
+    if data_loader.KNN is not None:
+        neighbors = data_loader.KNN.neighbors_of(target_idx, count)
+        if neighbors is not None:
+            return neighbors, None
+    # Rows the precomputed graph does not cover fall back to an exact scan.
+    target_embedding = data_loader.ENGINE.matrix[target_idx]
+    top_indices, similarities = data_loader.ENGINE.top_k(target_embedding, count + 1)
+    keep = top_indices != target_idx
+    return top_indices[keep][:count], similarities[keep][:count]
+
+def rank_default(since_ms: Optional[int] = None) -> Ranking:
+    """Every resolved row, most recently updated first (a view, not a copy)."""
+    if data_loader.ROWS is None:
+        return _no_hits()
+    return data_loader.ROWS.updated_between(start_ms=since_ms), None
+
+def _gather(ranking: Ranking) -> List[Dict[str, Any]]:
+    return data_loader.ROWS.gather(ranking[0]) if data_loader.ROWS is not None else []
 
-def get_default_results() -> List[Dict[str, Any]]:
-    if not data_loader.SOFTWARE_DATA or not data_loader.VECTOR_INDEX:
+def perform_search(query: str, offset: int = 0, limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    import logging
+    logging.info(f"perform_search called with query: '{query}'")
+    if not query:
+        logging.warning("Query is empty.")
         return []
-    indexed_packages = []
-    for metadata_id in data_loader.VECTOR_INDEX['metadata']:
-        try:
-            key, version_idx_str = metadata_id.split('::')
-            version_idx = int(version_idx_str)
-            software_info = data_loader.SOFTWARE_DATA[key]
-            version_data = software_info['Versions'][version_idx].copy()
-            version_data['SoftwareTitle'] = software_info.get('Title', key)
-            version_data['__metadata_id'] = metadata_id
-            indexed_packages.append(version_data)
-        except (KeyError, IndexError, ValueError):
-            continue
-    indexed_packages.sort(key=lambda v: int(re.search(r'\((\d+)\)', v.get("LastUpdated", "/Date(0)/")).group(1) or 0), reverse=True)
-    return indexed_packages[:50]
-
-def format_timestamp(date_str: Optional[str]) -> str:
-    if not date_str:
-        return "N/A"
-    match = re.search(r'\((\d+)\)', date_str)
-    if match:
-        timestamp_ms = match.group(1)
-        if timestamp_ms:
-            timestamp = int(timestamp_ms) / 1000
-            try:
-                return datetime.fromtimestamp(timestamp).strftime('%d %B %Y')
-            except (ValueError, OSError):
-                return "Invalid Date"
-    return "Invalid Date"
\ No newline at end of file
+    results = _gather(slice_ranking(rank_search_batch([query], offset + limit)[0], offset))
+    logging.info(f"perform_search returning {len(results)} results.")
+    return results
+
+def perform_tag_filter(tag: str) -> List[Dict[str, Any]]:
+    """Filter by a tag expression such as ``devtools+tag:python`` (see ``tags.parse_tag_query``)."""
+    return _gather(rank_tag_filter(tag))
+
+def find_related_packages(target_pkg_data: dict, count: int = 4) -> List[Dict[str, Any]]:
+    return _gather(rank_related(target_pkg_data.get('__metadata_id'), count))
+
+def get_default_results(since_ms: Optional[int] = None, offset: int = 0, limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Most recently updated packages, optionally only those updated at or after ``since_ms``."""
+    return _gather(slice_ranking(rank_default(since_ms), offset, offset + limit))
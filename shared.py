@@ -0,0 +1,66 @@
+"""Publish NumPy arrays through ``multiprocessing.shared_memory`` so worker processes
+can attach to them as zero-copy views instead of each holding a private copy.
+
+A handle is a plain picklable dict ``{key: (block name, shape, dtype str)}`` that
+can be sent over a ``multiprocessing.Queue``.
+"""
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+SharedHandle = Dict[str, Tuple[str, tuple, str]]
+
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    """Attach without tracking: an attaching process must not unlink the block when it exits."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching always registers the block with this process's
+        # resource tracker, which would unlink it for the whole pool when this worker exits.
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+
+def publish_arrays(arrays: Dict[str, np.ndarray]) -> Tuple[List[shared_memory.SharedMemory], SharedHandle, Dict[str, np.ndarray]]:
+    """Copy arrays into new shared blocks; return the blocks, a handle and views onto the blocks.
+
+    Keep the blocks referenced for as long as the views are used.
+    """
+    blocks, handle, views = [], {}, {}
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        view[...] = array
+        view.flags.writeable = False
+        blocks.append(block)
+        handle[key] = (block.name, array.shape, array.dtype.str)
+        views[key] = view
+    return blocks, handle, views
+
+
+def attach_arrays(handle: SharedHandle) -> Tuple[List[shared_memory.SharedMemory], Dict[str, np.ndarray]]:
+    """Attach to published arrays as read-only views; keep the blocks referenced while in use."""
+    blocks, arrays = [], {}
+    for key, (name, shape, dtype) in handle.items():
+        block = _attach_block(name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[key] = array
+    return blocks, arrays
+
+
+def unlink_handle(handle: SharedHandle) -> None:
+    """Remove published blocks; attached processes keep their mappings until they close them."""
+    for name, _, _ in handle.values():
+        try:
+            # A tracked attach: unlink() below unregisters the block again, leaving the tracker balanced.
+            block = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        block.close()
+        block.unlink()
@@ -0,0 +1,108 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_EMPTY = np.empty(0, dtype=np.int32)
+
+# Operators only count in front of another ``tag:`` term, so tags such as ``c++`` stay intact.
+_OR = re.compile(r'\|(?=\s*[-!]?\s*tag:)', re.IGNORECASE)
+_AND = re.compile(r'\+(?=\s*[-!]?\s*tag:)', re.IGNORECASE)
+
+
+def normalize_tags(tags: Any) -> List[str]:
+    """Turn a tag list or a whitespace/comma separated tag string into unique lowercase tags."""
+    if not tags:
+        return []
+    items = tags.replace(',', ' ').split() if isinstance(tags, str) else tags
+    seen = []
+    for item in items:
+        tag = str(item).strip().lower()
+        if tag and tag not in seen:
+            seen.append(tag)
+    return seen
+
+
+def parse_tag_query(expression: str) -> List[Tuple[List[str], List[str]]]:
+    """Parse a tag expression into OR-ed clauses of (required tags, excluded tags).
+
+    ``+`` joins terms with AND, ``|`` separates OR alternatives (lower precedence)
+    and a leading ``-`` or ``!`` negates a term. Every term after the first carries
+    its own ``tag:`` prefix, so ``devtools+tag:python|tag:rust+-tag:gui`` is valid
+    and ``c++`` or ``notepad++`` is a single tag.
+    """
+    clauses = []
+    for alternative in _OR.split(expression):
+        include, exclude = [], []
+        for term in _AND.split(alternative):
+            term = term.strip().lower()
+            negate = term[:1] in ('-', '!')
+            if negate:
+                term = term[1:].strip()
+            if term.startswith('tag:'):
+                term = term[4:].strip()
+            if term:
+                (exclude if negate else include).append(term)
+        if include or exclude:
+            clauses.append((include, exclude))
+    return clauses
+
+
+class TagIndex:
+    """Inverted index from normalized tag to a sorted int32 posting array of row ids."""
+
+    def __init__(self, postings: Dict[str, np.ndarray], n_rows: int):
+        self.postings = postings
+        self.n_rows = n_rows
+
+    @classmethod
+    def from_tag_map(cls, tag_map: Dict[str, Any], row_by_id: Dict[str, int], n_rows: int) -> "TagIndex":
+        """Build from the index's ``tag_map`` of metadata id to tags."""
+        buckets: Dict[str, List[int]] = {}
+        for metadata_id, tags in tag_map.items():
+            row = row_by_id.get(metadata_id)
+            if row is None:
+                continue
+            for tag in normalize_tags(tags):
+                buckets.setdefault(tag, []).append(row)
+        return cls({tag: np.unique(np.asarray(rows, dtype=np.int32)) for tag, rows in buckets.items()}, n_rows)
+
+    @classmethod
+    def from_postings(cls, tags: List[str], offsets: np.ndarray, rows: np.ndarray, n_rows: int) -> "TagIndex":
+        """Build from packed postings, ``rows[offsets[i]:offsets[i + 1]]`` for ``tags[i]``, without copying."""
+        return cls({tag: rows[offsets[i]:offsets[i + 1]] for i, tag in enumerate(tags)}, n_rows)
+
+    def packed(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """The postings as (tags, offsets, rows), the inverse of ``from_postings``."""
+        tags = sorted(self.postings)
+        offsets = np.zeros(len(tags) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(self.postings[tag]) for tag in tags], dtype=np.int64), out=offsets[1:])
+        rows = np.concatenate([self.postings[tag] for tag in tags]) if tags else _EMPTY
+        return tags, offsets, rows.astype(np.int32, copy=False)
+
+    def __len__(self) -> int:
+        return len(self.postings)
+
+    def posting(self, tag: str) -> np.ndarray:
+        return self.postings.get(tag, _EMPTY)
+
+    def match(self, expression: str) -> np.ndarray:
+        """Return the sorted row ids matching a tag expression (see ``parse_tag_query``)."""
+        matched: Optional[np.ndarray] = None
+        for include, exclude in parse_tag_query(expression):
+            if include:
+                # Intersect smallest-first so the working set shrinks as fast as possible.
+                lists = sorted((self.posting(tag) for tag in include), key=len)
+                rows = lists[0]
+                for posting in lists[1:]:
+                    if not rows.size:
+                        break
+                    rows = np.intersect1d(rows, posting, assume_unique=True)
+            else:
+                rows = np.arange(self.n_rows, dtype=np.int32)
+            for tag in exclude:
+                if not rows.size:
+                    break
+                rows = np.setdiff1d(rows, self.posting(tag), assume_unique=True)
+            matched = rows if matched is None else np.union1d(matched, rows)
+        return _EMPTY if matched is None else matched
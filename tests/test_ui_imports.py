@@ -0,0 +1,36 @@
+"""The UI process must not import the index or model libraries; only search workers do."""
+import os
+import subprocess
+import sys
+import textwrap
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['numpy', 'torch', 'sentence_transformers', 'sklearn', 'data_loader', 'search', 'worker']
+
+# Runs in a fresh interpreter so modules imported by the test session don't leak in.
+# flet is stubbed when it isn't installed; ui.py only touches it at import time to build constants.
+_PROBE = textwrap.dedent("""
+    import importlib.util
+    import json
+    import sys
+    import types
+    from unittest import mock
+
+    if importlib.util.find_spec('flet') is None:
+        flet = types.ModuleType('flet')
+        flet.__getattr__ = lambda name: mock.MagicMock(name='flet.' + name)
+        sys.modules['flet'] = flet
+
+    import ipc, formatting, ui
+
+    print(json.dumps(sorted(name for name in {heavy!r} if name in sys.modules)))
+""")
+
+
+def test_ui_imports_no_heavy_modules():
+    probe = _PROBE.format(heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', probe], cwd=REPO_ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    loaded = result.stdout.strip().splitlines()[-1]
+    assert loaded == '[]', f"UI process imported {loaded}"
@@ -5,10 +5,9 @@ import threading
 from typing import List, Optional, Callable
 from datetime import datetime, timedelta
 
-from data_loader import _top_tags
+from formatting import format_timestamp
 from ipc import SearchWorker
 from typing import Awaitable
-import search
 
 # --- Basic Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -36,6 +35,14 @@ _sort_dropdown: ft.Dropdown = None
 _recent_toggle: ft.Switch = None
 _top_tags: List[str] = []
 _search_worker: SearchWorker = None
+_worker_ready: bool = False  # set when the search worker's readiness handshake arrives
+_SEARCH_SESSION = "results-view"  # newer searches from the results view supersede older ones
+_FIRST_PAGE_SIZE = 10  # results rendered before the rest of a streamed search arrives
+_RESULTS_PAGE_SIZE = 50  # results fetched per page; scrolling near the end loads the next one
+_LOAD_MORE_EXTENT_PX = 300
+_results_offset: int = 0
+_results_exhausted: bool = True
+_loading_more: bool = False
 _debounce_task: Optional[asyncio.Task] = None
 _theme_toggle: Optional[ft.Switch] = None
 
@@ -122,6 +129,12 @@ async def show_package_details_global(pkg_data: dict):
     if not _page_ref:
         return
 
+    if pkg_data.get("__compact"):
+        # Result cards only carry display fields; fetch the full record for the dialog.
+        details = await _search_worker.adetails(pkg_data.get("__metadata_id"))
+        if isinstance(details, dict) and "error" not in details:
+            pkg_data = details
+
     async def show_related_package(new_pkg_data: dict):
         close_dialog_global(package_detail_dialog)
         await asyncio.sleep(0.05)
@@ -142,7 +155,7 @@ async def show_package_details_global(pkg_data: dict):
 
     details_column = [
         ft.Text(f"Version: {pkg_data.get('Version', 'N/A')}", color=TEXT_SECONDARY, size=14),
-        ft.Text(f"Last Updated: {search.format_timestamp(pkg_data.get('LastUpdated'))}", color=TEXT_SECONDARY, size=14),
+        ft.Text(f"Last Updated: {format_timestamp(pkg_data.get('LastUpdated'))}", color=TEXT_SECONDARY, size=14),
         ft.Container(height=15),
         ft.Text("Summary:", weight=ft.FontWeight.BOLD, color=TEXT_PRIMARY, size=16),
         ft.Text(pkg_data.get("Summary", "Not available."), color=TEXT_PRIMARY, size=15, selectable=True),
@@ -194,7 +207,9 @@ async def show_package_details_global(pkg_data: dict):
     )
     _page_ref.update()
 
-    related_packages = await asyncio.to_thread(search.find_related_packages, pkg_data)
+    related_packages = await _search_worker.arelated(pkg_data.get("__metadata_id"), compact=True)
+    if isinstance(related_packages, dict):
+        related_packages = []
 
     if related_packages:
         suggestion_chips = [
@@ -339,8 +354,9 @@ def create_package_list_item(pkg_data: dict):
 
 
 async def run_search_and_update_view(query: str):
-    global _last_query
+    global _last_query, _results_offset, _results_exhausted
     _last_query = query
+    _results_exhausted = True
     if not _page_ref or (not _package_list_view_ref and not _results_grid_ref):
         return
 
@@ -361,21 +377,58 @@ async def run_search_and_update_view(query: str):
     container.controls.append(loading_indicator)
     _page_ref.update()
 
-    results = await asyncio.to_thread(_search_worker.search, query)
+    results: List[dict] = []
+    stream = _search_worker.search_stream(query, session=_SEARCH_SESSION, first_page=_FIRST_PAGE_SIZE, limit=_RESULTS_PAGE_SIZE)
+    async for chunk in stream:
+        if isinstance(chunk, dict):
+            if chunk.get("superseded"):
+                # A newer query from this view is already running and will render instead.
+                return
+            logging.error(f"Search worker returned an error: {chunk.get('error')}")
+            break
+        results.extend(chunk)
+        if not stream.done():
+            # Show the first page while the rest of the results are on their way.
+            _render_results(container, query, results, pending=loading_indicator)
+        else:
+            _results_offset = _RESULTS_PAGE_SIZE
+            _results_exhausted = len(results) < _RESULTS_PAGE_SIZE
+    _render_results(container, query, results)
+
+
+async def load_more_results():
+    """Append the next page of the current query's results to the results view."""
+    global _results_offset, _results_exhausted, _loading_more
+    container = _results_grid_ref or _package_list_view_ref
+    if _loading_more or _results_exhausted or not container or not _search_worker:
+        return
+    query = _last_query
+    _loading_more = True
+    try:
+        page = await _search_worker.asearch(query, session=_SEARCH_SESSION, compact=True,
+                                            offset=_results_offset, limit=_RESULTS_PAGE_SIZE)
+    finally:
+        _loading_more = False
+    if query != _last_query or isinstance(page, dict):
+        # Superseded by a new search, or the worker failed; the newer view wins.
+        return
+    _results_offset += _RESULTS_PAGE_SIZE
+    _results_exhausted = len(page) < _RESULTS_PAGE_SIZE
+    # Later pages are appended in their own order so the rows already shown do not move.
+    container.controls.extend(create_package_list_item(pkg_data) for pkg_data in _filter_and_sort(page))
+    _page_ref.update()
+
+
+def _on_results_scroll(e: ft.OnScrollEvent):
+    if e.max_scroll_extent and e.pixels >= e.max_scroll_extent - _LOAD_MORE_EXTENT_PX:
+        _page_ref.run_task(load_more_results)
 
-    # Filters/sort
-    results = results or []
 
+def _filter_and_sort(results: List[dict]) -> List[dict]:
+    results = list(results)
     if _recent_toggle and _recent_toggle.value:
-        cutoff = datetime.utcnow() - timedelta(days=90)
-        def _is_recent(pkg: dict):
-            ts = pkg.get("LastUpdated")
-            try:
-                dt = datetime.utcfromtimestamp(ts) if isinstance(ts, (int, float)) else datetime.fromisoformat(str(ts))
-                return dt >= cutoff
-            except Exception:
-                return False
-        results = [r for r in results if _is_recent(r)]
+        cutoff_ms = int((datetime.now() - timedelta(days=90)).timestamp() * 1000)
+        results = [r for r in results if (r.get("__updated_ms") or 0) >= cutoff_ms]
 
     if _sort_dropdown:
         if _sort_dropdown.value == "az":
@@ -383,11 +436,24 @@ async def run_search_and_update_view(query: str):
         elif _sort_dropdown.value == "za":
             results.sort(key=lambda x: (x.get("SoftwareTitle") or "").lower(), reverse=True)
         else:
-            results.sort(key=lambda x: x.get("LastUpdated") or 0, reverse=True)
+            results.sort(key=lambda x: x.get("__updated_ms") or 0, reverse=True)
+    return results
 
+
+def _render_results(container, query: str, results: List[dict], pending: Optional[ft.Control] = None):
+    """Filter, sort and show ``results``; ``pending`` stays at the end while more are coming."""
+    results = _filter_and_sort(results)
     container.controls.clear()
 
-    if results:
+    if any(pkg_data.get("__lexical") for pkg_data in results):
+        container.controls.append(
+            ft.Text("Semantic search is still loading; showing keyword matches for now.", italic=True, color=TEXT_SECONDARY, size=12)
+        )
+
+    if pending is not None:
+        container.controls.extend(create_package_list_item(pkg_data) for pkg_data in results)
+        container.controls.append(pending)
+    elif results:
         for pkg_data in results:
             item = create_package_list_item(pkg_data)
             container.controls.append(item)
@@ -525,7 +591,8 @@ async def show_initial_screen():
             _debouncer.trigger(e.control.value)
 
     _current_search_query_field = ft.TextField(
-        hint_text="Search for applications...",
+        hint_text="Search for applications..." if _worker_ready else "Loading search index...",
+        disabled=not _worker_ready,
         expand=True,
         border_radius=SEARCH_BAR_RADIUS,
         content_padding=ft.padding.symmetric(horizontal=30, vertical=22),
@@ -545,6 +612,7 @@ async def show_initial_screen():
 
     search_button_initial = ft.ElevatedButton(
         "Search",
+        disabled=not _worker_ready,
         on_click=lambda _: _page_ref.run_task(show_results_screen, _current_search_query_field.value),
         style=ft.ButtonStyle(
             shape=ft.RoundedRectangleBorder(radius=SEARCH_BAR_RADIUS),
@@ -619,6 +687,7 @@ async def show_initial_screen():
             ft.Text("Pro tips", size=16, weight=ft.FontWeight.W_600),
             ft.Text("• Press Ctrl/Cmd+K to focus search", color=TEXT_SECONDARY, size=12),
             ft.Text("• Type tag:devtools to filter by tag", color=TEXT_SECONDARY, size=12),
+            ft.Text("• Combine tags: tag:devtools+tag:python, tag:a|tag:b, tag:editor+-tag:gui", color=TEXT_SECONDARY, size=12),
             ft.Text("• Use A→Z sort on results", color=TEXT_SECONDARY, size=12),
             ft.Container(height=10),
             ft.Text("Recent searches", size=16, weight=ft.FontWeight.W_600),
@@ -776,10 +845,12 @@ async def show_results_screen(query: str):
 
     # List vs Grid
     if _is_wide:
-        _results_grid_ref = ft.GridView(expand=True, runs_count=0, max_extent=420, child_aspect_ratio=2.8, spacing=12, run_spacing=12)
+        _results_grid_ref = ft.GridView(expand=True, runs_count=0, max_extent=420, child_aspect_ratio=2.8, spacing=12, run_spacing=12,
+                                        on_scroll=_on_results_scroll, on_scroll_interval=100)
         _package_list_view_ref = None
     else:
-        _package_list_view_ref = ft.ListView(expand=True, spacing=12, padding=ft.padding.only(top=10, bottom=20))
+        _package_list_view_ref = ft.ListView(expand=True, spacing=12, padding=ft.padding.only(top=10, bottom=20),
+                                             on_scroll=_on_results_scroll, on_scroll_interval=100)
         _results_grid_ref = None
 
     # Recent searches chips under bar
@@ -961,9 +1032,19 @@ async def main(page: ft.Page, search_worker: SearchWorker):
         _sync_layout_with_window()
     page.on_resize = on_resize
 
-    test = await asyncio.to_thread(_search_worker.search, "")
-    if isinstance(test, dict) and test.get("error"):
-        page.add(
+    # Show the start screen right away; search is enabled once the worker reports ready.
+    _sync_layout_with_window()
+    await show_initial_screen()
+    page.run_task(_await_worker_ready)
+
+
+async def _await_worker_ready():
+    global _worker_ready
+    status = await _search_worker.aready()
+    if status.get("error"):
+        _page_ref.controls.clear()
+        _page_ref.appbar = None
+        _page_ref.add(
             ft.Column(
                 [
                     ft.Icon(name=ft.Icons.ERROR_OUTLINE_ROUNDED, color=ft.Colors.RED_600, size=50),
@@ -977,11 +1058,13 @@ async def main(page: ft.Page, search_worker: SearchWorker):
                 spacing=20, expand=True
             )
         )
-        page.update()
+        _page_ref.update()
         return
 
-    _sync_layout_with_window()
-    await show_initial_screen()
+    _top_tags[:] = status.get("top_tags", [])
+    _worker_ready = True
+    if _current_screen == "initial":
+        await show_initial_screen()
 
 
 def _sync_layout_with_window():
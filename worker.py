@@ -0,0 +1,424 @@
+"""The search worker process: loads the index and model and answers requests from ``ipc.SearchWorker``.
+
+Only the worker imports this module (through ``ipc._worker_main``), so NumPy,
+torch and sentence-transformers stay out of the UI process.
+"""
+import collections
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import GenerationCache, LRUCache
+import data_loader
+from ipc import SUPERSEDED
+import search
+
+# How often an idle worker wakes up to swap in a rebuilt index or check the source files.
+_IDLE_POLL_S = 0.5
+
+
+def _query_mode(query: str) -> Tuple[str, str]:
+    """Classify a query as ('tag', expression), ('search', text) or ('default', '')."""
+    if query.lower().startswith('tag:'):
+        return 'tag', query.split(':', 1)[1]
+    if query:
+        return 'search', query
+    return 'default', ''
+
+
+def _run_query(mode: str, argument: str) -> search.Ranking:
+    if mode == 'tag':
+        return search.rank_tag_filter(argument)
+    if mode == 'search':
+        return search.rank_search_batch([argument])[0]
+    return search.rank_default()
+
+
+def _ranking_depth(message: Dict[str, Any]) -> int:
+    """Rows a search message needs ranked, rounded up to whole pages so nearby pages share a ranking."""
+    stop = max(0, message.get('offset', 0)) + max(0, message.get('limit', search.PAGE_SIZE))
+    return max(1, -(-stop // search.PAGE_SIZE)) * search.PAGE_SIZE
+
+
+def _covers(entry: Tuple[search.Ranking, Optional[int]], depth: int) -> bool:
+    """Whether a cached (ranking, depth) entry answers ``depth`` rows; depth None means complete."""
+    ranking, computed = entry
+    # A semantic ranking shorter than its depth already holds every row above the threshold;
+    # the ANN path widens its probes until it has ``depth`` candidates, so this holds there too.
+    return computed is None or computed >= depth or len(ranking[0]) < computed
+
+
+def _materialize(ranking: search.Ranking, compact: bool = False, lexical: bool = False):
+    """Reply payload for a ranking: full result dicts, or ``RowTable.compact`` columns.
+
+    ``lexical`` marks a compact reply as keyword matches served in place of a semantic search.
+    """
+    rows = data_loader.ROWS
+    if rows is None:
+        return []
+    row_ids, scores = ranking
+    if not compact:
+        return rows.gather(row_ids)
+    payload = rows.compact(row_ids, scores)
+    payload['lexical'] = lexical
+    return payload
+
+
+def _cache_key(mode: str, argument: str) -> Tuple[str, str]:
+    if mode == 'search':
+        return mode, search.normalize_query(argument)
+    return mode, argument.strip().lower()
+
+
+class WorkerLoop:
+    """The request loop that runs inside each search worker process."""
+
+    def __init__(self, worker_id: int, request_q: multiprocessing.Queue, response_q: multiprocessing.Queue, options: Dict[str, Any]):
+        self.worker_id = worker_id
+        self.name = f"SearchWorker-{worker_id}"
+        self.request_q = request_q
+        self.response_q = response_q
+        self.options = options
+        self._backlog: collections.deque = collections.deque()
+        # Hot reload: the next generation is built in _reload_thread and swapped in between batches.
+        self._reload_thread: Optional[threading.Thread] = None
+        self._next_generation: Optional[Dict[str, Any]] = None
+        self._reload_timings: Dict[str, float] = {}
+        self._reload_waiters: List[int] = []
+        self._next_follow: Optional[Dict[str, Any]] = None
+        self._publisher_lost = False
+        self._next_watch = 0.0
+        self._pending_stamps = None
+        self._failed_stamps = None
+
+    def run(self):
+        import logging
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        logging.info(f"{self.name} process started. Attempting to load data and index...")
+        options = self.options
+        data_loader.QUANTIZATION = options['quantization']
+        data_loader.RERANK_FACTOR = options['rerank_factor']
+        shared_index = None
+        if options['share_memory'] and self.worker_id != 0:
+            logging.info(f"{self.name} waiting for SearchWorker-0 to publish the embedding matrix...")
+            message = self._wait_for_shared_index()
+            if message.get('type') == 'stop':
+                return
+            shared_index = message.get('shared_index')
+        success = data_loader.load_index(shared_index=shared_index)
+        if not success and shared_index:
+            logging.warning(f"{self.name} could not attach the shared embedding matrix; loading a private copy.")
+            success = data_loader.load_index()
+        if not success:
+            logging.error(f"{self.name} failed to load data/index. Returning error to main process.")
+            self.response_q.put({'worker': self.worker_id, 'error': 'load_failed', 'timings': dict(data_loader.LOAD_TIMINGS)})
+            return
+        logging.info(f"{self.name} successfully loaded data and index; loading the model in the background.")
+        # Tag, default and related queries need no model, so start answering them now.
+        threading.Thread(target=self._load_model, name=f"{self.name}-model", daemon=True).start()
+        if options['share_memory'] and self.worker_id == 0:
+            try:
+                handle = data_loader.publish_shared_index()
+            except Exception as e:
+                logging.error(f"{self.name} could not publish the embedding matrix: {e}")
+                handle = None
+            self.response_q.put({'worker': self.worker_id, 'shared_index': handle})
+        search.EMBEDDING_CACHE = LRUCache(options['embedding_cache_size'])
+        search.ANN_ENABLED = options['use_ann']
+        search.ANN_NPROBE = options['ann_nprobe']
+        if options['use_ann'] and data_loader.ANN is None:
+            logging.warning("ANN search requested but no usable ANN index was loaded; using exact search.")
+        result_cache = GenerationCache(options['result_cache_size'])
+        # Readiness handshake: the client enables search once a worker reports in.
+        self.response_q.put({'worker': self.worker_id, 'status': self._status()})
+        while True:
+            batch = self._collect_batch()
+            logging.info(f"{self.name} received {len(batch)} message(s): {batch}")
+            if self._handle_batch(batch, result_cache):
+                logging.info(f"{self.name} received stop signal. Exiting.")
+                break
+        if options['share_memory'] and self.worker_id == 0:
+            # Unlink here rather than leaving it to the client, so this process's resource tracker stays clean.
+            data_loader.unlink_shared_index()
+
+    def _wait_for_shared_index(self) -> Dict[str, Any]:
+        """Hold queued requests until the 'attach' (or 'stop') message arrives and return it."""
+        while True:
+            message = self.request_q.get()
+            if message.get('type') in ('attach', 'stop'):
+                return message
+            self._backlog.append(message)
+
+    def _collect_batch(self) -> List[Dict[str, Any]]:
+        """Take the next batch: wait for the first message, drain the queue, drop superseded queries."""
+        backlog = self._backlog
+        self._between_batches()
+        if not backlog:
+            while True:
+                try:
+                    backlog.append(self.request_q.get(timeout=_IDLE_POLL_S))
+                    break
+                except queue.Empty:
+                    self._between_batches()
+            deadline = time.monotonic() + self.options['batch_window']
+            while len(backlog) < self.options['batch_size']:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    backlog.append(self.request_q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        # Take everything already queued so newer queries can supersede older ones.
+        while True:
+            try:
+                backlog.append(self.request_q.get_nowait())
+            except queue.Empty:
+                break
+        self._drop_superseded(backlog)
+        return [backlog.popleft() for _ in range(min(self.options['batch_size'], len(backlog)))]
+
+    def _drop_superseded(self, backlog: collections.deque):
+        """Answer queued searches that a later search from the same session replaced, and drop them."""
+        latest: Dict[str, int] = {}
+        for position, message in enumerate(backlog):
+            if message.get('type') == 'search' and message.get('session') is not None:
+                latest[message['session']] = position
+        if not latest:
+            return
+        kept = collections.deque()
+        for position, message in enumerate(backlog):
+            session = message.get('session')
+            if message.get('type') == 'search' and session is not None and latest[session] != position:
+                self.response_q.put({'id': message.get('id'), 'result': SUPERSEDED})
+            else:
+                kept.append(message)
+        skipped = len(backlog) - len(kept)
+        if skipped:
+            import logging
+            logging.info(f"{self.name} skipped {skipped} superseded queries.")
+        backlog.clear()
+        backlog.extend(kept)
+
+    def _handle_batch(self, batch: List[Dict[str, Any]], result_cache: GenerationCache) -> bool:
+        """Answer every message in ``batch`` in arrival order; return True if one asked to stop."""
+        import logging
+        result_cache.sync(data_loader.GENERATION)
+        answers: Dict[Tuple[str, str], search.Ranking] = {}
+        semantic: Dict[Tuple[str, str], str] = {}
+        queries: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        depths: Dict[Tuple[str, str], int] = {}
+        for message in batch:
+            if message.get('type', 'search') != 'search':
+                continue
+            mode, argument = _query_mode(message.get('query', ''))
+            key = _cache_key(mode, argument)
+            queries[key] = (mode, argument)
+            depths[key] = max(depths.get(key, 0), _ranking_depth(message))
+        for key, (mode, argument) in queries.items():
+            cached = result_cache.get(key)
+            if cached is not None and _covers(cached, depths[key]):
+                logging.info(f"{self.name} serving cached results for {key}.")
+                answers[key] = cached[0]
+            elif mode == 'search':
+                semantic[key] = argument
+            else:
+                answers[key] = _run_query(mode, argument)
+                result_cache.put(key, (answers[key], None))
+        lexical = set()
+        if semantic and data_loader.MODEL is None:
+            # The model is still loading (or failed to): degrade to keyword matches, uncached.
+            for key, argument in semantic.items():
+                answers[key] = search.rank_lexical(argument, depths[key])
+                lexical.add(key)
+        elif semantic:
+            # One encode call and one matrix-matrix product for every uncached semantic query.
+            depth = max(depths[key] for key in semantic)
+            for key, ranking in zip(semantic, search.rank_search_batch(list(semantic.values()), depth)):
+                answers[key] = ranking
+                result_cache.put(key, (ranking, depth))
+
+        stop = False
+        tails: List[Tuple[Dict[str, Any], search.Ranking, bool]] = []
+        for message in batch:
+            message_type = message.get('type')
+            if message_type == 'stop':
+                stop = True
+            elif message_type == 'stats':
+                self.response_q.put({'id': message.get('id'), 'result': {
+                    'embedding_cache': search.EMBEDDING_CACHE.stats(),
+                    'result_cache': result_cache.stats(),
+                }})
+            elif message_type == 'status':
+                self.response_q.put({'id': message.get('id'), 'result': self._status()})
+            elif message_type == 'reload':
+                # Answered once the new generation is live (see _swap).
+                self._reload_waiters.append(message.get('id'))
+                if not self._follows_reloads():
+                    self._start_reload("reload requested")
+            elif message_type == 'follow_reload':
+                self._follow_reload(message)
+            elif message_type == 'publisher_lost':
+                self._lose_publisher()
+            elif message_type == 'related':
+                ranking = self._related(message, result_cache)
+                self.response_q.put({'id': message.get('id'), 'result': _materialize(ranking, message.get('compact', False))})
+            elif message_type == 'details':
+                self.response_q.put({'id': message.get('id'), 'result': self._details(message)})
+            else:
+                offset = message.get('offset', 0)
+                key = _cache_key(*_query_mode(message.get('query', '')))
+                ranking = answers[key]
+                ranking = search.slice_ranking(ranking, offset, offset + message.get('limit', search.PAGE_SIZE))
+                logging.info(f"{self.name} sending {len(ranking[0])} results back.")
+                first_page = message.get('first_page')
+                if first_page and len(ranking[0]) > first_page:
+                    # Streamed: the first page goes out now, the rest once every first page is sent.
+                    tails.append((message, search.slice_ranking(ranking, first_page), key in lexical))
+                    ranking = search.slice_ranking(ranking, 0, first_page)
+                    self.response_q.put({'id': message.get('id'), 'result': _materialize(ranking, True, key in lexical), 'more': True})
+                else:
+                    self.response_q.put({'id': message.get('id'), 'result': _materialize(ranking, message.get('compact', False), key in lexical)})
+        for message, tail, tail_lexical in tails:
+            self.response_q.put({'id': message.get('id'), 'result': _materialize(tail, True, tail_lexical)})
+        return stop
+
+    def _between_batches(self):
+        """Swap in a finished reload, then check whether the source files changed."""
+        if self._reload_thread is not None and not self._reload_thread.is_alive():
+            self._swap()
+        self._watch_files()
+
+    def _follows_reloads(self) -> bool:
+        """In a shared-memory pool only SearchWorker-0 reloads; the others attach to what it publishes."""
+        return self.options['share_memory'] and self.worker_id != 0 and not self._publisher_lost
+
+    def _lose_publisher(self):
+        """SearchWorker-0 died: reload and watch the files on our own from now on."""
+        import logging
+        logging.warning(f"{self.name} lost SearchWorker-0; reloading independently from now on.")
+        self._publisher_lost = True
+        self._next_follow = None
+        if self._reload_waiters:
+            self._start_reload("reload requested")
+
+    def _follow_reload(self, message: Dict[str, Any]):
+        if not message.get('ok'):
+            self._fail_waiters()
+        elif self._reload_thread is not None:
+            # Still building the previous one; follow the newest publication once it is swapped in.
+            self._next_follow = message
+        else:
+            self._start_reload("SearchWorker-0 reloaded", message.get('shared_index'))
+
+    def _watch_files(self):
+        interval = self.options['watch_interval']
+        if (not interval or self._follows_reloads() or self._reload_thread is not None
+                or time.monotonic() < self._next_watch):
+            return
+        self._next_watch = time.monotonic() + interval
+        stamps = data_loader.source_stamps()
+        if stamps == data_loader.SOURCE_STAMPS or stamps == self._failed_stamps:
+            self._pending_stamps = None
+            return
+        if data_loader.STORE is not None and stamps[2] is None:
+            # The index directory is being rewritten; its manifest comes last.
+            return
+        if stamps != self._pending_stamps:
+            # Wait until the files look the same on two checks so a half-written file is not loaded.
+            self._pending_stamps = stamps
+            return
+        self._pending_stamps = None
+        self._start_reload("source files changed")
+
+    def _start_reload(self, reason: str, shared_index=None):
+        import logging
+        if self._reload_thread is not None:
+            return
+        logging.info(f"{self.name} reloading data and index ({reason}).")
+        self._reload_thread = threading.Thread(target=self._build_next, args=(shared_index,),
+                                               name=f"{self.name}-reload", daemon=True)
+        self._reload_thread.start()
+
+    def _build_next(self, shared_index=None):
+        import logging
+        self._reload_timings = {}
+        generation = data_loader.build_generation(shared_index=shared_index, timings=self._reload_timings)
+        if generation is None and shared_index:
+            logging.warning(f"{self.name} could not attach the reloaded matrix; loading a private copy.")
+            generation = data_loader.build_generation(timings=self._reload_timings)
+        self._next_generation = generation
+
+    def _fail_waiters(self):
+        waiters, self._reload_waiters = self._reload_waiters, []
+        for request_id in waiters:
+            self.response_q.put({'id': request_id, 'result': {'error': 'reload_failed'}})
+
+    def _swap(self):
+        """Make the rebuilt generation live and release the old one; runs between batches only."""
+        import logging
+        self._reload_thread = None
+        generation, self._next_generation = self._next_generation, None
+        publishes = self.options['share_memory'] and self.worker_id == 0
+        if generation is None:
+            logging.error(f"{self.name} reload failed; still serving generation {data_loader.GENERATION}.")
+            self._failed_stamps = data_loader.source_stamps()
+            self._fail_waiters()
+            if publishes:
+                self.response_q.put({'worker': self.worker_id, 'reloaded': {'ok': False}})
+            return
+        previous = data_loader.activate(generation)
+        data_loader.LOAD_TIMINGS.update(self._reload_timings)
+        # Requests already answered used the old generation; nothing references it any more.
+        # Workers still attached to SearchWorker-0's old block keep their mapping until they swap too.
+        data_loader.release_generation(previous)
+        if publishes:
+            try:
+                handle = data_loader.publish_shared_index()
+            except Exception as e:
+                logging.error(f"{self.name} could not publish the reloaded embedding matrix: {e}")
+                handle = None
+            self.response_q.put({'worker': self.worker_id, 'reloaded': {'ok': True, 'shared_index': handle}})
+        waiters, self._reload_waiters = self._reload_waiters, []
+        status = self._status()
+        logging.info(f"{self.name} swapped in generation {data_loader.GENERATION} with {status['rows']} rows.")
+        for request_id in waiters:
+            self.response_q.put({'id': request_id, 'result': status})
+        self.response_q.put({'worker': self.worker_id, 'status': status})
+        if self._next_follow is not None:
+            message, self._next_follow = self._next_follow, None
+            self._follow_reload(message)
+
+    def _load_model(self):
+        data_loader.load_model()
+        self.response_q.put({'worker': self.worker_id, 'status': self._status()})
+
+    def _status(self) -> Dict[str, Any]:
+        rows = data_loader.ROWS
+        return {
+            'worker': self.worker_id,
+            'ready': rows is not None,
+            'model': data_loader.MODEL_STATE,
+            'generation': data_loader.GENERATION,
+            'rows': len(rows) if rows is not None else 0,
+            'timings': dict(data_loader.LOAD_TIMINGS),
+            'top_tags': list(data_loader._top_tags),
+        }
+
+    def _related(self, message: Dict[str, Any], result_cache: GenerationCache) -> search.Ranking:
+        metadata_id = message.get('metadata_id')
+        count = message.get('count', 4)
+        key = ('related', f"{metadata_id}::{count}")
+        ranking = result_cache.get(key)
+        if ranking is None:
+            ranking = search.rank_related(metadata_id, count)
+            result_cache.put(key, ranking)
+        return ranking
+
+    def _details(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The full result record for one metadata id, or None if it is unknown."""
+        rows = data_loader.ROWS
+        row = rows.row_of(message.get('metadata_id')) if rows is not None else None
+        return rows.record(row) if row is not None else None